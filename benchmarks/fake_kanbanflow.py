@@ -0,0 +1,266 @@
+"""Local stand-in for the parts of the KanbanFlow API that KanbanFlowBoard uses.
+
+Serves /api/v1/board, /api/v1/tasks (including the columnId, swimlaneId, limit and startTaskId paging parameters)
+and the per-task comment and subtask endpoints from memory, with optional per-request latency and a per-minute rate
+limit (or per rate_window seconds) that answers 429 with Retry-After like the real service. Task changes are also
+recorded as KanbanFlow webhook events, which take_events() hands over for replay_events.replay() to post to a webhook
+receiver.
+"""
+import itertools
+import json
+import re
+from urllib.parse import parse_qs
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TASK_PATH = re.compile(r"^/api/v1/tasks/([^/]+)$")
+COMMENTS_PATH = re.compile(r"^/api/v1/tasks/([^/]+)/comments$")
+COMMENT_PATH = re.compile(r"^/api/v1/tasks/([^/]+)/comments/([^/]+)$")
+SUBTASKS_PATH = re.compile(r"^/api/v1/tasks/([^/]+)/subtasks$")
+
+
+class FakeBoardState:
+    """A board's columns and swimlanes, as (ID, name) pairs, and its tasks. New tasks go in the first swimlane."""
+
+    def __init__(self, columns, swimlanes=None):
+        self.columns = columns
+        self.swimlanes = swimlanes or [("swimlane-1", "Default")]
+        self.swimlane = self.swimlanes[0][0]
+        self.tasks = dict()
+        self.comments = dict()
+        self.subtasks = dict()
+        self.ids = itertools.count(1)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def next_id(self, prefix):
+        return "{0}{1}".format(prefix, next(self.ids))
+
+    def board(self):
+        return {"_id": "board-1", "name": "Benchmark",
+                "columns": [{"uniqueId": _id, "name": name} for _id, name in self.columns],
+                "swimlanes": [{"uniqueId": _id, "name": name} for _id, name in self.swimlanes],
+                "colors": [{"name": "Red", "value": "red"}]}
+
+    def columns_with_tasks(self, column_id=None, limit=None, start_task_id=None, swimlane_id=None):
+        """Like GET /tasks: an entry per column, or per column and swimlane on a board with several swimlanes."""
+        lanes = [(None, None)]
+        if len(self.swimlanes) > 1:
+            lanes = [(_id, name) for _id, name in self.swimlanes if swimlane_id is None or _id == swimlane_id]
+
+        result = []
+        for _id, column_name in self.columns:
+            if column_id is not None and _id != column_id:
+                continue
+            for lane_id, lane_name in lanes:
+                tasks = [task for task in self.tasks.values() if task["columnId"] == _id
+                         and (lane_id is None or task.get("swimlaneId", self.swimlane) == lane_id)]
+                if start_task_id is not None:
+                    start = next((index for index, task in enumerate(tasks) if task["_id"] == start_task_id),
+                                 len(tasks))
+                    tasks = tasks[start:]
+                column = {"columnId": _id, "columnName": column_name, "tasksLimited": False, "tasks": tasks}
+                if lane_id is not None:
+                    column.update(swimlaneId=lane_id, swimlaneName=lane_name)
+                if limit is not None and len(tasks) > limit:
+                    column.update(tasksLimited=True, nextTaskId=tasks[limit]["_id"], tasks=tasks[:limit])
+                result.append(column)
+        return result
+
+    def move_all(self, column_id):
+        with self.lock:
+            for task in self.tasks.values():
+                old_column_id, task["columnId"] = task["columnId"], column_id
+                if old_column_id != column_id:
+                    self.record_event("taskChanged", task, {"columnId": (old_column_id, column_id)})
+
+    def record_event(self, event_type, task, changes=None):
+        """Record a webhook event with the task's state after the change; changes maps property to (old, new)."""
+        event = {"eventType": event_type, "timestamp": time.time(), "task": dict(task)}
+        if changes:
+            event["changedProperties"] = [{"property": name, "oldValue": old, "newValue": new}
+                                          for name, (old, new) in changes.items()]
+        self.events.append(event)
+
+    def take_events(self):
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+
+class FakeKanbanFlowServer:
+    """Runs FakeBoardState behind a threaded HTTP server on localhost, counting requests and bytes."""
+
+    def __init__(self, columns, latency=0.0, rate_limit=0, port=0, swimlanes=None, rate_window=60):
+        self.state = FakeBoardState(columns, swimlanes)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.recent = deque()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.counter_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self.handler_class())
+        self.thread = None
+
+    @property
+    def api_uri(self):
+        host, port = self.httpd.server_address
+        return "http://{0}:{1}/api/v1/".format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        with self.counter_lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.throttled = 0
+
+    def admit(self):
+        """Count the request and return the Retry-After seconds if it's over the rate limit, else None."""
+        with self.counter_lock:
+            self.requests += 1
+            if not self.rate_limit:
+                return None
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= self.rate_window:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                self.throttled += 1
+                return int(self.rate_window - (now - self.recent[0])) + 1
+            self.recent.append(now)
+            return None
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch("GET")
+
+            def do_POST(self):
+                self.dispatch("POST")
+
+            def do_DELETE(self):
+                self.dispatch("DELETE")
+
+            def dispatch(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                retry_after = server.admit()
+                if retry_after is not None:
+                    self.respond(429, {"errorMessage": "Rate limit exceeded"}, {"Retry-After": str(retry_after)})
+                    return
+
+                with server.state.lock:
+                    status, payload = route(server.state, method, self.path, body)
+                self.respond(status, payload)
+
+            def respond(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with server.counter_lock:
+                    server.bytes_sent += len(data)
+
+        return Handler
+
+
+def route(state, method, path, body):
+    path, _, query = path.partition("?")
+    path = path.rstrip("/")
+    params = dict((key, values[0]) for key, values in parse_qs(query).items())
+
+    if path == "/api/v1/board" and method == "GET":
+        return 200, state.board()
+
+    if path == "/api/v1/tasks":
+        if method == "GET":
+            if "startTaskId" in params and len(state.swimlanes) > 1 and "swimlaneId" not in params:
+                return 400, {"errorMessage": "swimlaneId is required with startTaskId on a board with swimlanes"}
+            limit = int(params["limit"]) if "limit" in params else None
+            return 200, state.columns_with_tasks(params.get("columnId"), limit, params.get("startTaskId"),
+                                                 params.get("swimlaneId"))
+        if method == "POST":
+            _id = state.next_id("task-")
+            task = dict(body, _id=_id)
+            task.setdefault("swimlaneId", state.swimlane)
+            state.tasks[_id] = task
+            state.comments[_id] = []
+            state.subtasks[_id] = [{"name": subtask["name"], "finished": subtask.get("finished", False)}
+                                   for subtask in task.pop("subTasks", [])]
+            state.record_event("taskCreated", task)
+            return 200, {"taskId": _id, "taskNumber": len(state.tasks)}
+
+    match = TASK_PATH.match(path)
+    if match:
+        _id = match.group(1)
+        if _id not in state.tasks:
+            return 404, {"errorMessage": "Task not found"}
+        if method == "GET":
+            return 200, state.tasks[_id]
+        if method == "POST":
+            task = state.tasks[_id]
+            changes = dict((name, (task.get(name), value)) for name, value in body.items() if task.get(name) != value)
+            task.update(body)
+            state.record_event("taskChanged", task, changes)
+            return 200, {}
+        if method == "DELETE":
+            state.record_event("taskDeleted", state.tasks.pop(_id))
+            return 200, {}
+
+    match = COMMENTS_PATH.match(path)
+    if match:
+        _id = match.group(1)
+        if _id not in state.tasks:
+            return 404, {"errorMessage": "Task not found"}
+        if method == "GET":
+            return 200, state.comments[_id]
+        if method == "POST":
+            comment_id = state.next_id("comment-")
+            state.comments[_id].append({"_id": comment_id, "text": body["text"]})
+            return 200, {"insertedId": comment_id}
+
+    match = COMMENT_PATH.match(path)
+    if match and method == "DELETE":
+        _id, comment_id = match.groups()
+        state.comments[_id] = [comment for comment in state.comments.get(_id, []) if comment["_id"] != comment_id]
+        return 200, {}
+
+    match = SUBTASKS_PATH.match(path)
+    if match:
+        _id = match.group(1)
+        if _id not in state.tasks:
+            return 404, {"errorMessage": "Task not found"}
+        if method == "GET":
+            return 200, state.subtasks[_id]
+        if method == "POST":
+            state.subtasks[_id].append({"name": body["name"], "finished": body.get("finished", False)})
+            return 200, {"insertedIndex": len(state.subtasks[_id]) - 1}
+
+    return 404, {"errorMessage": "Unknown endpoint {0} {1}".format(method, path)}
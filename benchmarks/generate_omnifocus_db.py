@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""Generate a synthetic Omnifocus database
+
+Writes the Task, TaskToTag, Context and ProjectInfo tables that omnifocus.py queries, filled with flagged tasks
+and nested subtasks.
+
+Usage:
+  generate_omnifocus_db.py <path> [--tasks=<n>] [--depth=<n>] [--max-tags=<n>] [--seed=<n>]
+  generate_omnifocus_db.py -h | --help
+
+Options:
+  --tasks=<n>     Total number of tasks, including subtasks [default: 1000]
+  --depth=<n>     Maximum subtask depth [default: 3]
+  --max-tags=<n>  Maximum tags per task [default: 1]
+  --seed=<n>      Random seed [default: 1]
+
+"""
+import os
+import random
+import sqlite3
+
+TAGS = ["work", "home", "errands", "calls"]
+PROJECTS = 20
+
+SCHEMA = """
+CREATE TABLE Task (
+    persistentIdentifier TEXT PRIMARY KEY,
+    name TEXT,
+    plainTextNote TEXT,
+    containingProjectInfo TEXT,
+    parent TEXT,
+    blocked INTEGER,
+    blockedByFutureStartDate INTEGER,
+    flagged INTEGER,
+    effectiveFlagged INTEGER,
+    dateCompleted REAL,
+    dateDue TEXT,
+    dateToStart TEXT,
+    effectiveDateToStart TEXT,
+    dateModified REAL,
+    childrenCount INTEGER,
+    repetitionMethodString TEXT,
+    containsNextTask INTEGER
+);
+CREATE INDEX Task_parent ON Task (parent);
+CREATE TABLE TaskToTag (task TEXT, tag TEXT);
+CREATE INDEX TaskToTag_task ON TaskToTag (task);
+CREATE TABLE Context (persistentIdentifier TEXT PRIMARY KEY, name TEXT);
+CREATE TABLE ProjectInfo (task TEXT PRIMARY KEY, status TEXT);
+"""
+
+
+def generate(path, task_count=1000, max_depth=3, seed=1, max_tags=1):
+    """Write a database of task_count tasks: flagged top-level tasks, each with up to max_depth levels of
+    subtasks. About one in ten top-level tasks is deferred, completed or repeating to exercise the filters. Each task
+    tree gets between one and max_tags tags."""
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO Context VALUES (?, ?)", [("tag-{0}".format(tag), tag) for tag in TAGS])
+
+    for index in range(PROJECTS):
+        project_id = "project-{0}".format(index)
+        add_task(conn, project_id, "Project {0}".format(index), None, project_id, flagged=0)
+        conn.execute("INSERT INTO ProjectInfo VALUES (?, ?)", (project_id, "active"))
+
+    created = 0
+    root = 0
+    while created < task_count:
+        project_id = "project-{0}".format(rng.randrange(PROJECTS))
+        root_id = "task-{0}".format(root)
+        root += 1
+        tag = rng.choice(TAGS)
+        # only draws more random numbers with extra tags, so the default database stays the same
+        tags = [tag]
+        if max_tags > 1:
+            tags += rng.sample([other for other in TAGS if other != tag], rng.randrange(min(max_tags, len(TAGS))))
+        kind = rng.random()
+        add_task(conn, root_id, "Task {0}".format(root_id), None, project_id, flagged=1,
+                 note=rng.choice([None, "Notes for {0}".format(root_id)]),
+                 date_to_start="2099-01-01T00:00:00.000Z" if kind < 0.03 else None,
+                 completed=1.0 if 0.03 <= kind < 0.06 else None,
+                 repetition="fixed" if 0.06 <= kind < 0.1 else None)
+        add_tags(conn, root_id, tags)
+        created += 1
+        created += add_children(conn, rng, root_id, project_id, tags, max_depth, task_count - created)
+
+    conn.execute("UPDATE Task SET childrenCount = (SELECT count(*) FROM Task AS child "
+                 "WHERE child.parent = Task.persistentIdentifier)")
+    conn.execute("UPDATE Task SET containsNextTask = childrenCount > 0")
+    conn.commit()
+    conn.close()
+    return created
+
+
+def add_children(conn, rng, parent_id, project_id, tags, depth, budget):
+    if depth <= 0 or budget <= 0:
+        return 0
+
+    created = 0
+    for index in range(min(rng.randrange(5), budget)):
+        child_id = "{0}.{1}".format(parent_id, index)
+        add_task(conn, child_id, "Step {0}".format(child_id), parent_id, project_id, flagged=0,
+                 blocked=1 if index else 0)
+        add_tags(conn, child_id, tags)
+        created += 1
+        created += add_children(conn, rng, child_id, project_id, tags, depth - 1, budget - created)
+    return created
+
+
+def add_tags(conn, _id, tags):
+    conn.executemany("INSERT INTO TaskToTag VALUES (?, ?)", [(_id, "tag-" + tag) for tag in tags])
+
+
+def add_task(conn, _id, name, parent, project_id, flagged, note=None, blocked=0, date_to_start=None, completed=None,
+             repetition=None):
+    conn.execute("INSERT INTO Task (persistentIdentifier, name, plainTextNote, containingProjectInfo, parent, "
+                 "blocked, blockedByFutureStartDate, flagged, effectiveFlagged, dateCompleted, dateToStart, "
+                 "effectiveDateToStart, dateModified, childrenCount, repetitionMethodString, containsNextTask) "
+                 "VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, 1.0, 0, ?, 0)",
+                 (_id, name, note, project_id, parent, blocked, flagged, flagged, completed, date_to_start,
+                  date_to_start, repetition))
+
+
+if __name__ == '__main__':
+    from docopt import docopt
+
+    opts = docopt(__doc__)
+    count = generate(opts['<path>'], int(opts['--tasks']), int(opts['--depth']), int(opts['--seed']),
+                     int(opts['--max-tags']))
+    print("Wrote {0} tasks to {1}".format(count, opts['<path>']))
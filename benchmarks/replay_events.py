@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""Replay KanbanFlow webhook events
+
+Posts events to a webhook receiver (of-to-kb --receive-webhooks) the way KanbanFlow would, one request per event,
+so the receiver and event-driven syncs can be exercised without the live service. <file> holds one JSON event per
+line, e.g. KanbanFlow webhook payloads saved from a request inspector. run_benchmarks.py --webhooks calls replay()
+directly with the events fake_kanbanflow.py records in memory, no file involved.
+
+Usage:
+  replay_events.py <url> <file> [--delay=<s>]
+  replay_events.py -h | --help
+
+Options:
+  --delay=<s>  Seconds to wait between events [default: 0]
+
+"""
+import json
+import time
+from urllib.request import Request, urlopen
+
+
+def replay(url, events, delay=0.0):
+    """POST each event to url in order, failing on the first one the receiver doesn't accept. Returns the count."""
+    count = 0
+    for event in events:
+        request = Request(url, json.dumps(event).encode("utf-8"), {"Content-Type": "application/json"})
+        with urlopen(request) as response:
+            response.read()
+        count += 1
+        if delay:
+            time.sleep(delay)
+    return count
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    from docopt import docopt
+
+    opts = docopt(__doc__)
+    count = replay(opts['<url>'], read_events(opts['<file>']), float(opts['--delay']))
+    print("Replayed {0} event(s) to {1}".format(count, opts['<url>']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""Offline sync benchmarks
+
+Runs first sync, steady-state no-op, mass completion and post-completion scenarios against a local fake KanbanFlow
+server and a generated Omnifocus database, reporting wall time, API calls, bytes, peak memory and how many tasks
+were handed to AppleScript to close. With --webhooks the board is
+kept up to date from the fake server's webhook events, replayed through a local receiver before each sync.
+
+Usage:
+  run_benchmarks.py [--tasks=<n>...] [--depth=<n>] [--max-tags=<n>] [--latency=<s>] [--rate-limit=<n>] [--webhooks]
+                    [--json]
+  run_benchmarks.py -h | --help
+
+Options:
+  --tasks=<n>       Omnifocus database size, may be repeated [default: 1000]
+  --depth=<n>       Maximum subtask depth [default: 3]
+  --max-tags=<n>    Maximum tags per task [default: 1]
+  --latency=<s>     Seconds of latency added to every fake API request [default: 0]
+  --rate-limit=<n>  Requests per minute before the fake server answers 429, 0 for no limit [default: 0]
+  --webhooks        Load the board from queued webhook events instead of reading it each sync
+  --json            Print results as JSON
+
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "omnifocustokanban"))
+
+from applescript_executor import RecordingExecutor
+from event_queue import EventQueue
+from fake_kanbanflow import FakeKanbanFlowServer
+from generate_omnifocus_db import generate, TAGS
+from id_store import IdStore
+from kanban_flow_board import KanbanFlowBoard
+from omnifocus import Omnifocus
+from replay_events import replay
+from sync_metrics import SyncMetrics
+from sync_plan import plan_sync, SyncExecutor
+from webhook_receiver import WebhookReceiver
+
+COLUMNS = [("todo", "To-do"), ("doing", "In progress"), ("done", "Done")]
+CARD_TYPES = dict((tag, {"color": "red"}) for tag in TAGS)
+
+
+class BenchmarkEnvironment:
+    def __init__(self, workdir, task_count, depth, latency, rate_limit, webhooks=False, max_tags=1):
+        self.db_path = os.path.join(workdir, "OmniFocusDatabase.db")
+        self.task_count = generate(self.db_path, task_count, depth, max_tags=max_tags)
+        self.id_store = IdStore(os.path.join(workdir, "kanbanflow-ids.db"))
+        self.server = FakeKanbanFlowServer(COLUMNS, latency, rate_limit).start()
+        self.executor = RecordingExecutor()
+        self.metrics = SyncMetrics()
+        self.event_queue = None
+        self.receiver = None
+        if webhooks:
+            queue_path = os.path.join(workdir, "kanbanflow-events.db")
+            self.event_queue = EventQueue(queue_path)
+            self.receiver = WebhookReceiver(EventQueue(queue_path, check_same_thread=False), port=0).start()
+
+    def board(self):
+        return KanbanFlowBoard("benchmark", "todo", CARD_TYPES, ["done"], self.id_store,
+                               api_uri=self.server.api_uri, metrics=self.metrics, event_queue=self.event_queue)
+
+    def sync(self):
+        if self.receiver is not None:
+            replay(self.receiver.url, self.server.state.take_events())
+        board = self.board()
+        omnifocus = Omnifocus(self.executor, self.db_path, card_types=CARD_TYPES)
+        with self.metrics.phase("omnifocus_read"):
+            tasks = list(omnifocus.iter_flagged_tasks())
+        with self.metrics.phase("plan"):
+            plan = plan_sync(board, omnifocus, board.completed_tasks, tasks)
+        result = SyncExecutor(board, omnifocus).execute(plan)
+        omnifocus.close()
+        self.complete_tasks([task["id"] for task in result[1] + result[2]])
+        return result
+
+    def complete_tasks(self, identifiers):
+        """Mark tasks closed through the RecordingExecutor completed in the database, as Omnifocus would."""
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany("UPDATE Task SET dateCompleted = ? WHERE persistentIdentifier = ?",
+                         [(time.time(), _id) for _id in identifiers])
+        conn.commit()
+        conn.close()
+
+    def close(self):
+        self.server.stop()
+        self.id_store.close()
+        if self.receiver is not None:
+            self.receiver.stop()
+
+
+def first_sync(env):
+    env.sync()
+
+
+def steady_state(env):
+    env.sync()
+
+
+def mass_completion(env):
+    env.server.state.move_all("done")
+    env.sync()
+
+
+def after_completion(env):
+    # the cards stay in the done lane, but their tasks are all closed now
+    env.sync()
+
+
+SCENARIOS = [first_sync, steady_state, mass_completion, after_completion]
+
+
+def measure(env, scenario):
+    env.server.reset_counters()
+    env.executor.calls = []
+    env.metrics = SyncMetrics()
+    tracemalloc.start()
+    start = time.perf_counter()
+    scenario(env)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"scenario": scenario.__name__, "tasks": env.task_count, "seconds": round(elapsed, 3),
+            "api_calls": env.server.requests, "bytes": env.server.bytes_sent, "throttled": env.server.throttled,
+            "peak_memory_kb": peak // 1024, "closes": sum(len(call) for call in env.executor.calls),
+            "phases": dict((name, phase["seconds"]) for name, phase in env.metrics.to_dict()["phases"].items())}
+
+
+def run(task_counts, depth, latency, rate_limit, webhooks=False, max_tags=1):
+    results = []
+    for task_count in task_counts:
+        with tempfile.TemporaryDirectory() as workdir:
+            env = BenchmarkEnvironment(workdir, task_count, depth, latency, rate_limit, webhooks, max_tags)
+            try:
+                # scenarios run in order against the same board: first sync fills it, the rest build on that
+                for scenario in SCENARIOS:
+                    results.append(measure(env, scenario))
+            finally:
+                env.close()
+    return results
+
+
+def main():
+    from docopt import docopt
+
+    opts = docopt(__doc__)
+    logging.basicConfig(level=logging.CRITICAL)
+    results = run([int(count) for count in opts['--tasks']], int(opts['--depth']), float(opts['--latency']),
+                  int(opts['--rate-limit']), opts['--webhooks'], int(opts['--max-tags']))
+
+    if opts['--json']:
+        print(json.dumps(results, indent=2))
+        return
+
+    print("{0:<16} {1:>7} {2:>9} {3:>9} {4:>11} {5:>9} {6:>10} {7:>7}".format(
+        "scenario", "tasks", "seconds", "api calls", "bytes", "throttled", "peak KB", "closes"))
+    for result in results:
+        print("{scenario:<16} {tasks:>7} {seconds:>9} {api_calls:>9} {bytes:>11} {throttled:>9} "
+              "{peak_memory_kb:>10} {closes:>7}".format(**result))
+
+
+if __name__ == '__main__':
+    main()
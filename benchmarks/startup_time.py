@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""of-to-kb startup time
+
+Measures the import time of of-to-kb's startup paths with python -X importtime, net of the interpreter's own
+startup. It fails if a path imports a module it shouldn't (e.g. the async engine on a plain sync), or if a path got
+more than --tolerance percent slower than in a saved baseline.
+
+Usage:
+  startup_time.py [--repeat=<n>] [--baseline=<file>] [--tolerance=<pct>] [--save=<file>] [--json]
+  startup_time.py -h | --help
+
+Options:
+  --repeat=<n>       Runs per path, the fastest one counts [default: 5]
+  --baseline=<file>  JSON results of an earlier run to compare against
+  --tolerance=<pct>  How much slower than the baseline a path may get before failing [default: 25]
+  --save=<file>      Write the results as JSON, for use as a later --baseline
+  --json             Print results as JSON
+
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SOURCE = os.path.join(ROOT, "omnifocustokanban")
+
+# name, command line after "python -X importtime", modules that path must not import
+PATHS = [
+    ("help", [os.path.join(SOURCE, "of-to-kb"), "--help"],
+     ["requests", "yaml", "asyncio", "aiohttp", "applescript", "sqlite3"]),
+    ("sync", ["-c", "import kanban_board, kanban_flow_board, omnifocus, sync_plan, id_store"],
+     ["asyncio", "aiohttp", "applescript", "inotify_simple", "sync_daemon", "change_tracker"]),
+]
+
+
+def import_times(args):
+    """Run python -X importtime with args and return {top-level module: cumulative microseconds}."""
+    env = dict(os.environ, PYTHONPATH=SOURCE)
+    process = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=ROOT, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = modules.get(name.strip(), 0)
+        if not name.startswith("  "):
+            # only top-level imports, nested ones are already in their importer's cumulative time
+            modules[name.strip()] += int(cumulative)
+    return modules
+
+
+def measure(args, repeat):
+    """Fastest of repeat runs: total import time and the modules imported, both net of a bare interpreter."""
+    best = None
+    for _ in range(repeat):
+        interpreter = import_times(["-c", "pass"])
+        modules = import_times(args)
+        extra = dict((name, us) for name, us in modules.items() if name not in interpreter)
+        total = sum(extra.values())
+        if best is None or total < best[0]:
+            best = (total, extra)
+    return best
+
+
+def run(repeat):
+    results = []
+    for name, args, forbidden in PATHS:
+        total, modules = measure(args, repeat)
+        imported = set(name.split(".")[0] for name in modules)
+        slowest = sorted((item for item in modules.items() if item[1]), key=lambda item: -item[1])[:5]
+        results.append({"path": name, "import_ms": round(total / 1000.0, 1),
+                        "forbidden": sorted(imported.intersection(forbidden)),
+                        "slowest": [[module, round(us / 1000.0, 1)] for module, us in slowest]})
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    limits = dict((result["path"], result["import_ms"] * (1 + tolerance / 100.0)) for result in baseline)
+    failures = []
+    for result in results:
+        if result["forbidden"]:
+            failures.append("{0} imports {1}".format(result["path"], ", ".join(result["forbidden"])))
+        limit = limits.get(result["path"])
+        if limit is not None and result["import_ms"] > limit:
+            failures.append("{0} takes {1}ms to import, over the {2}ms limit".format(
+                result["path"], result["import_ms"], round(limit, 1)))
+    return failures
+
+
+def main():
+    from docopt import docopt
+
+    opts = docopt(__doc__)
+    results = run(int(opts['--repeat']))
+
+    baseline = []
+    if opts['--baseline']:
+        with open(opts['--baseline']) as f:
+            baseline = json.load(f)
+
+    if opts['--save']:
+        with open(opts['--save'], "w") as f:
+            json.dump(results, f, indent=2)
+
+    if opts['--json']:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print("{0:<6} {1:>7}ms  slowest: {2}".format(result["path"], result["import_ms"], ", ".join(
+                "{0} {1}ms".format(module, ms) for module, ms in result["slowest"])))
+
+    failures = regressions(results, baseline, float(opts['--tolerance']))
+    for failure in failures:
+        print("FAIL: " + failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
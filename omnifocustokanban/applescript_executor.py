@@ -0,0 +1,79 @@
+import logging
+
+CLOSED = "closed"
+ALREADY_COMPLETED = "completed"
+NOT_FOUND = "missing"
+
+CLOSE_TASKS = """
+        on close_tasks(task_ids)
+            set results to {}
+            tell application "OmniFocus"
+                repeat with task_id in task_ids
+                    try
+                        set theTask to task id (task_id as text) of default document
+                        if completed of theTask then
+                            set end of results to "completed"
+                        else
+                            mark complete theTask
+                            set end of results to "closed"
+                        end if
+                    on error
+                        set end of results to "missing"
+                    end try
+                end repeat
+            end tell
+            return results
+        end close_tasks
+    """
+
+
+class AppleScriptExecutor:
+    """Closes Omnifocus tasks through AppleScript, one script call for a whole list of task IDs."""
+    log = logging.getLogger(__name__)
+
+    def __init__(self):
+        self.script = None
+
+    def close_tasks(self, task_ids):
+        """Mark the tasks complete, returning CLOSED, ALREADY_COMPLETED or NOT_FOUND for each ID."""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+
+        if self.script is None:
+            import applescript
+            self.script = applescript.AppleScript(CLOSE_TASKS)
+
+        self.log.debug("Closing {0} task(s) in Omnifocus".format(len(task_ids)))
+        results = self.script.call('close_tasks', task_ids)
+        return dict(zip(task_ids, results))
+
+
+class RecordingExecutor:
+    """Stand-in for AppleScriptExecutor that records calls instead of talking to Omnifocus.
+
+    Tasks listed in completed or missing report ALREADY_COMPLETED or NOT_FOUND, everything else is CLOSED (and
+    then counts as completed for later calls).
+    """
+
+    def __init__(self, completed=(), missing=()):
+        self.completed = set(completed)
+        self.missing = set(missing)
+        self.calls = []
+
+    def close_tasks(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+
+        self.calls.append(task_ids)
+        results = dict()
+        for task_id in task_ids:
+            if task_id in self.missing:
+                results[task_id] = NOT_FOUND
+            elif task_id in self.completed:
+                results[task_id] = ALREADY_COMPLETED
+            else:
+                results[task_id] = CLOSED
+                self.completed.add(task_id)
+        return results
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from kanban_flow_board import KanbanFlowBoard, API_URI, DEFAULT_BOARD_CACHE_TTL, DEFAULT_REQUEST_TIMEOUT, \
+    task_page_query, column_pages, next_task_id, create_body, subtask_body, strip_id_marker
+from sync_plan import CardCreate, CardUpdate
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_REQUESTS_PER_MINUTE = 100
+DEFAULT_MAX_RETRIES = 5
+# requests that can be sent again after a transport error without doing anything twice
+IDEMPOTENT_METHODS = ("GET", "DELETE")
+
+
+class TokenBucket:
+    """Spaces requests so that no 60 second window sees more than rate_per_minute of them.
+
+    The bucket starts with a small burst allowance and refills at whatever rate keeps burst + refill within the
+    limit. A 429 response pauses the bucket for the Retry-After period and empties it.
+    """
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.capacity = burst or max(1, rate_per_minute // 10)
+        self.rate = max(rate_per_minute - self.capacity, 1) / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+class AsyncKanbanFlowBoard(KanbanFlowBoard):
+    """KanbanFlowBoard with the network calls as coroutines.
+
+    Calls that depend on each other (a task, then its comment and subtasks) are chained within a card while
+    separate cards run concurrently. Every request waits on a shared TokenBucket. A 429 is retried after its
+    Retry-After, a transport error only for GET and DELETE.
+    """
+
+    def __init__(self, token, default_drop_column, types, id_store=None,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, max_retries=DEFAULT_MAX_RETRIES,
+                 api_uri=API_URI, metrics=None, board_cache_ttl=DEFAULT_BOARD_CACHE_TTL,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for the async sync engine (pip install aiohttp)")
+
+        # load() gets the completed lanes; there's no event queue, the async engine always reads the whole board
+        super().__init__(token, default_drop_column, types, [], id_store, api_uri=api_uri, metrics=metrics,
+                         board_cache_ttl=board_cache_ttl, request_timeout=request_timeout)
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.bucket = None
+
+    def connect(self):
+        # the aiohttp session has to be made inside the event loop, so load() connects and reads the board
+        pass
+
+    async def load(self, completed_columns):
+        self.bucket = TokenBucket(self.requests_per_minute)
+        connect, read = self.request_timeout
+        self.session = aiohttp.ClientSession(headers=self.auth,
+                                             timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+        self.completed_columns = completed_columns
+        await self.load_board_details()
+        await self.classify_board(completed_columns)
+
+    async def load_board_details(self):
+        if not self.use_cached_board_details():
+            with self.metrics.phase("board_load"):
+                details = await self.request(self.board_uri)
+            self.use_fetched_board_details(details)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def classify_board(self, completed_columns, column_ids=None):
+        board_task_ids = set()
+        unread = []
+
+        async for column_id, tasks in self.iter_task_pages(column_ids):
+            is_completed_column = column_id in completed_columns
+            unknown_tasks = self.classify_known_tasks(tasks, column_id, is_completed_column, board_task_ids)
+
+            with self.metrics.phase("comment_scan"):
+                lookups = await asyncio.gather(*(self.get_comment_containing_id(task["_id"])
+                                                 for task in unknown_tasks))
+            unread.extend(self.classify_looked_up_tasks(unknown_tasks, lookups, column_id, is_completed_column))
+
+        self.finish_classifying(board_task_ids, unread, column_ids)
+
+    async def iter_task_pages(self, column_ids=None):
+        for column_id, swimlane_id in self.task_lanes(column_ids):
+            start_task_id = None
+            while True:
+                with self.metrics.phase("board_load"):
+                    page = await self.request(self.tasks_uri + "?" + task_page_query(column_id, start_task_id,
+                                                                                     swimlane_id))
+                entries = column_pages(page, column_id)
+                for entry in entries:
+                    yield column_id, entry.get("tasks") or []
+
+                start_task_id = next_task_id(entries)
+                if start_task_id is None:
+                    break
+
+    async def get_comment_containing_id(self, _id):
+        return self.comment_lookup(_id, await self.request(self.tasks_uri + "{0}/comments".format(_id)))
+
+    async def create_tasks(self, tasks):
+        self.log.debug(u"Checking which of {0} tasks to add".format(len(tasks)))
+        results = await asyncio.gather(*(self.sync_task(task) for task in tasks))
+        self.commit_fingerprints()
+        return sum(results)
+
+    async def sync_task(self, task):
+        item = self.plan_task(task)
+        if isinstance(item, CardCreate):
+            return await self.execute_create(item)
+        if isinstance(item, CardUpdate):
+            return await self.execute_update(item)
+        return 0
+
+    async def execute_create(self, create):
+        # the subtasks, in name order, and the external ID go in the same request
+        return self.record_create(create, await self.request(self.api_uri + "tasks", create_body(create)))
+
+    async def execute_update(self, update):
+        task_id = update.task_id
+        updates_made = 0
+        synced = True
+
+        if len(update.properties):
+            self.log.debug(u"Updating pre-existing task {0} '{1}'".format(update.identifier, update.name))
+            synced = await self.request(self.tasks_uri + "{0}".format(task_id), update.properties) is not None
+            self.record_properties_update(update, synced)
+            updates_made += 1
+
+        if update.subtasks:
+            existing_subtask_names = update.existing_subtask_names
+            if existing_subtask_names is None:
+                existing_subtask_names = await self.get_subtasks(task_id)
+            subtasks = self.subtasks_to_add(update, existing_subtask_names)
+            if subtasks is None:
+                return updates_made
+            for subtask in subtasks:
+                synced = await self.create_subtask(task_id, subtask) is not None and synced
+                updates_made += 1
+
+        self.record_update(update, synced)
+        return updates_made
+
+    async def create_subtask(self, task_id, subtask):
+        return await self.request(self.tasks_uri + "{0}/subtasks".format(task_id), subtask_body(subtask))
+
+    async def get_subtasks(self, task_id):
+        sub_tasks = await self.request(self.tasks_uri + "{0}/subtasks".format(task_id))
+        if sub_tasks is None:
+            return None
+        return [sub_task['name'] for sub_task in sub_tasks]
+
+    async def remove_external_id(self, identifier):
+        task_id, comment_id = self.get_stored_ids(identifier)
+
+        task = self.all_tasks.get(identifier)
+        if self.has_embedded_id(identifier):
+            description = strip_id_marker(task.get('description'))
+            if await self.request(self.tasks_uri + "{0}".format(task_id), {"description": description}) is not None:
+                task['description'] = description
+        elif comment_id is None:
+            _, comment = await self.get_comment_containing_id(task_id)
+            if comment is not None:
+                comment_id = comment["_id"]
+
+        if comment_id is not None:
+            await self.delete(self.tasks_uri + "{0}/comments/{1}".format(task_id, comment_id))
+        self.forget_card(task_id)
+
+    async def delete(self, url):
+        return await self.request(url, method="DELETE") is not None
+
+    async def request(self, url, body=None, method=None):
+        if method is None:
+            method = "POST" if body else "GET"
+
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                async with self.session.request(method, url, json=body) as response:
+                    content = await response.read()
+                    self.metrics.record_request(method, url[len(self.api_uri):], response.status,
+                                                time.perf_counter() - start, len(content))
+
+                    if response.status == 429:
+                        delay = retry_after(response.headers.get('Retry-After'), attempt)
+                        self.log.warning(u"Rate limited on {0} {1}, retrying in {2}s".format(method, url, delay))
+                        self.bucket.pause(delay)
+                        continue
+
+                    if response.status == 200:
+                        return json.loads(content) if content else {}
+
+                    self.log.error(u"{0} {1} failed with status {2}".format(method, url, response.status))
+                    return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.record_request(method, url[len(self.api_uri):], "error", time.perf_counter() - start)
+                if method not in IDEMPOTENT_METHODS:
+                    # the server may have acted on it before the connection failed, and posting a card again would
+                    # duplicate it; the card counts as failed and the next sync finds it by its marker if it was made
+                    self.log.error(u"{0} {1} failed ({2}), not retrying".format(method, url, e))
+                    return None
+                delay = retry_after(None, attempt)
+                self.log.warning(u"{0} {1} failed ({2}), retrying in {3}s".format(method, url, e, delay))
+                await asyncio.sleep(delay)
+
+        self.log.error(u"Giving up on {0} {1} after {2} attempts".format(method, url, self.max_retries + 1))
+        return None
+
+
+def retry_after(header, attempt):
+    """Seconds to wait before retrying, from a Retry-After header (seconds or HTTP date) or exponential backoff."""
+    if header:
+        try:
+            return max(float(header), 0)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(header)
+                return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
+            except (TypeError, ValueError):
+                pass
+    return min(2 ** attempt, 60)
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+import sqlite3
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS task_marker (
+    identifier TEXT PRIMARY KEY,
+    marker     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS database_state (
+    path  TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+"""
+
+
+class ChangeTracker:
+    """Remembers a change marker per Omnifocus task between runs so unchanged tasks can be skipped."""
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path):
+        self.log.debug("Using change tracker {0}".format(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(CREATE_SQL)
+        self.conn.commit()
+        self.markers = None
+        self.pending_state = None
+
+    def changed_tasks(self, omnifocus, full=False):
+        """Flagged tasks that are new or changed since the last commit, and the IDs of those that disappeared.
+
+        Skips reading Omnifocus altogether if its database files haven't been touched since the last commit. With
+        full, every flagged task is returned (and the markers refreshed) regardless.
+        """
+        db_path = omnifocus.of_location
+        state = database_state(db_path)
+        if not full and self.database_unchanged(db_path, state):
+            self.log.debug("Omnifocus database unchanged since last sync")
+            self.markers = None
+            return [], []
+
+        self.pending_state = (db_path, state)
+        # an incremental read only keeps the changed tasks, the rest are dropped as they stream past
+        tasks = omnifocus.iter_flagged_tasks()
+        if full:
+            tasks = list(tasks)
+        changed, removed = self.changes(tasks)
+        return (tasks if full else changed), removed
+
+    def database_unchanged(self, db_path, state):
+        """True if the Omnifocus database and its WAL file have the same mtime and size as at the last commit."""
+        cursor = self.conn.execute("SELECT state FROM database_state WHERE path = ?", (db_path,))
+        row = cursor.fetchone()
+        return row is not None and row['state'] == state
+
+    def changes(self, tasks):
+        """Split tasks into those that are new or changed since the last commit, and the IDs that disappeared."""
+        previous = dict((row['identifier'], row['marker']) for row in self.conn.execute("SELECT * FROM task_marker"))
+        self.markers = dict()
+        changed = []
+
+        for task in tasks:
+            identifier = task.identifier
+            marker = task_marker(task)
+            self.markers[identifier] = marker
+            if previous.get(identifier) != marker:
+                changed.append(task)
+
+        removed = [identifier for identifier in previous if identifier not in self.markers]
+        self.log.debug(u"{0} of {1} tasks changed, {2} disappeared".format(len(changed), len(self.markers),
+                                                                         len(removed)))
+        return changed, removed
+
+    def commit(self, failed=None):
+        """Save the markers from the last read, once its changes have been synced.
+
+        The tasks in failed didn't make it to the board, so their markers are left out and they count as changed
+        next time. The database state isn't saved either, so the next run reads the database rather than skipping it.
+        """
+        if failed:
+            self.log.debug(u"Not saving markers of {0} task(s) that failed to sync".format(len(failed)))
+            if self.markers is not None:
+                for identifier in failed:
+                    self.markers.pop(identifier, None)
+            self.pending_state = None
+
+        if self.markers is not None:
+            self.conn.execute("DELETE FROM task_marker")
+            self.conn.executemany("INSERT INTO task_marker (identifier, marker) VALUES (?, ?)",
+                                  self.markers.items())
+        if self.pending_state is not None:
+            self.conn.execute("INSERT OR REPLACE INTO database_state (path, state) VALUES (?, ?)", self.pending_state)
+        self.conn.commit()
+        self.markers = None
+        self.pending_state = None
+
+    def close(self):
+        self.conn.close()
+
+
+def database_state(db_path):
+    parts = []
+    for path in (db_path, db_path + "-wal"):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append("{0}:{1}".format(stat.st_mtime_ns, stat.st_size))
+        else:
+            parts.append("-")
+    return "|".join(parts)
+
+
+def task_marker(task):
+    """The task's modification timestamp where Omnifocus has one, otherwise a hash of its content."""
+    if task.modified is not None:
+        parts = ["m", str(task.modified), str(task.type), str(task.completed)]
+    else:
+        parts = ["c", task.name, task.note or "", str(task.type), str(task.completed)]
+
+    parts.extend(sorted(task_marker(child) for child in task.children or []))
+    return hashlib.sha1("\0".join(parts).encode('utf-8')).hexdigest()
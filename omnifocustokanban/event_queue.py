@@ -0,0 +1,50 @@
+import json
+import logging
+import sqlite3
+import time
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS event (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    received_at REAL NOT NULL,
+    payload     TEXT NOT NULL
+);
+"""
+
+
+class EventQueue:
+    """Durable FIFO of KanbanFlow webhook events, written by the webhook receiver and drained by sync runs.
+
+    Events are committed before the receiver answers KanbanFlow and only deleted once a sync has applied them, so an
+    event is applied at least once even if either side is killed part way.
+    """
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path, check_same_thread=True):
+        self.log.debug("Using event queue {0}".format(path))
+        # the receiver and a sync run usually have the queue open at the same time
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(CREATE_SQL)
+        self.conn.commit()
+
+    def put(self, events):
+        received_at = time.time()
+        self.conn.executemany("INSERT INTO event (received_at, payload) VALUES (?, ?)",
+                              [(received_at, json.dumps(event)) for event in events])
+        self.conn.commit()
+
+    def pending(self):
+        """Every queued event as (ID, event), oldest first."""
+        return [(row[0], json.loads(row[1])) for row in self.conn.execute("SELECT id, payload FROM event ORDER BY id")]
+
+    def last_id(self):
+        return self.conn.execute("SELECT IFNULL(MAX(id), 0) FROM event").fetchone()[0]
+
+    def ack(self, last_id):
+        """Drop every event up to and including last_id, once they've been applied."""
+        self.conn.execute("DELETE FROM event WHERE id <= ?", (last_id,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,154 @@
+import json
+import logging
+import sqlite3
+import time
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS card (
+    external_id TEXT PRIMARY KEY,
+    task_id     TEXT NOT NULL UNIQUE,
+    comment_id  TEXT,
+    column_id   TEXT,
+    fingerprint TEXT,
+    details     TEXT
+);
+CREATE TABLE IF NOT EXISTS unmapped_card (
+    task_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS board_metadata (
+    api_uri    TEXT PRIMARY KEY,
+    details    TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS board_scan (
+    api_uri    TEXT PRIMARY KEY,
+    scanned_at REAL NOT NULL
+);
+"""
+
+
+class IdStore:
+    """Persistent mapping of Omnifocus persistentIdentifier to KanbanFlow task, comment and column IDs, plus the
+    fingerprint of the Omnifocus task as last synced to the card and a cached copy of the board's layout. When the
+    board is kept up to date from webhook events, each card's last known task JSON is stored here as well."""
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path):
+        self.log.debug("Using ID store {0}".format(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(CREATE_SQL)
+        columns = [row['name'] for row in self.conn.execute("PRAGMA table_info(card)")]
+        if 'fingerprint' not in columns:
+            self.conn.execute("ALTER TABLE card ADD COLUMN fingerprint TEXT")
+        if 'details' not in columns:
+            self.conn.execute("ALTER TABLE card ADD COLUMN details TEXT")
+        self.conn.commit()
+
+    def get(self, external_id):
+        cursor = self.conn.execute("SELECT * FROM card WHERE external_id = ?", (external_id,))
+        return cursor.fetchone()
+
+    def get_by_task_id(self, task_id):
+        cursor = self.conn.execute("SELECT * FROM card WHERE task_id = ?", (task_id,))
+        return cursor.fetchone()
+
+    def all(self):
+        return self.conn.execute("SELECT * FROM card").fetchall()
+
+    def put(self, external_id, task_id, comment_id, column_id):
+        # a KanbanFlow task only ever carries one external ID, so drop any stale row pointing at it
+        self.conn.execute("DELETE FROM card WHERE task_id = ? AND external_id != ?", (task_id, external_id))
+        self.conn.execute("DELETE FROM unmapped_card WHERE task_id = ?", (task_id,))
+        # the fingerprint and task JSON only survive if the external ID still points at the same card
+        self.conn.execute("INSERT INTO card (external_id, task_id, comment_id, column_id) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT (external_id) DO UPDATE SET "
+                          "fingerprint = CASE WHEN task_id = excluded.task_id THEN fingerprint END, "
+                          "details = CASE WHEN task_id = excluded.task_id THEN details END, "
+                          "task_id = excluded.task_id, comment_id = excluded.comment_id, "
+                          "column_id = excluded.column_id", (external_id, task_id, comment_id, column_id))
+
+    def set_fingerprint(self, external_id, fingerprint):
+        self.conn.execute("UPDATE card SET fingerprint = ? WHERE external_id = ?", (fingerprint, external_id))
+
+    def remove(self, external_id):
+        self.conn.execute("DELETE FROM card WHERE external_id = ?", (external_id,))
+
+    def remove_task(self, task_id):
+        """Forget a KanbanFlow task that was deleted from the board, mapped or not."""
+        self.conn.execute("DELETE FROM card WHERE task_id = ?", (task_id,))
+        self.conn.execute("DELETE FROM unmapped_card WHERE task_id = ?", (task_id,))
+
+    def put_details(self, task_id, column_id, details):
+        """Store the task JSON and column of a mapped card; returns False if task_id isn't mapped."""
+        cursor = self.conn.execute("UPDATE card SET column_id = ?, details = ? WHERE task_id = ?",
+                                   (column_id, json.dumps(details), task_id))
+        return cursor.rowcount > 0
+
+    def card_details(self):
+        """(external ID, column ID, task JSON) for every mapped card, or None if any of them has no stored JSON."""
+        cards = []
+        for row in self.conn.execute("SELECT external_id, column_id, details FROM card"):
+            if row['details'] is None:
+                return None
+            cards.append((row['external_id'], row['column_id'], json.loads(row['details'])))
+        return cards
+
+    def is_unmapped(self, task_id):
+        cursor = self.conn.execute("SELECT 1 FROM unmapped_card WHERE task_id = ?", (task_id,))
+        return cursor.fetchone() is not None
+
+    def put_unmapped(self, task_id):
+        """Remember a card that has no external ID comment so it isn't looked up again."""
+        self.conn.execute("DELETE FROM card WHERE task_id = ?", (task_id,))
+        self.conn.execute("INSERT OR IGNORE INTO unmapped_card (task_id) VALUES (?)", (task_id,))
+
+    def retain_task_ids(self, task_ids):
+        """Forget every card whose KanbanFlow task is no longer on the board."""
+        stale = [row['task_id'] for row in self.all() if row['task_id'] not in task_ids]
+        if stale:
+            self.log.debug("Removing {0} stale entries from ID store".format(len(stale)))
+            self.conn.executemany("DELETE FROM card WHERE task_id = ?", [(_id,) for _id in stale])
+
+        unmapped = [row['task_id'] for row in self.conn.execute("SELECT task_id FROM unmapped_card")
+                    if row['task_id'] not in task_ids]
+        self.conn.executemany("DELETE FROM unmapped_card WHERE task_id = ?", [(_id,) for _id in unmapped])
+        return len(stale)
+
+    def get_board_details(self, api_uri, max_age):
+        """Return the cached /board response for api_uri if it's at most max_age seconds old, else None."""
+        cursor = self.conn.execute("SELECT details, fetched_at FROM board_metadata WHERE api_uri = ?", (api_uri,))
+        row = cursor.fetchone()
+        if row is None or time.time() - row['fetched_at'] > max_age:
+            return None
+        return json.loads(row['details'])
+
+    def put_board_details(self, api_uri, details):
+        self.conn.execute("INSERT OR REPLACE INTO board_metadata (api_uri, details, fetched_at) VALUES (?, ?, ?)",
+                          (api_uri, json.dumps(details), time.time()))
+
+    def clear_board_details(self):
+        self.conn.execute("DELETE FROM board_metadata")
+
+    def get_last_scan(self, api_uri):
+        """When the whole board at api_uri was last read from the API, as a time.time() value, or None."""
+        row = self.conn.execute("SELECT scanned_at FROM board_scan WHERE api_uri = ?", (api_uri,)).fetchone()
+        return row['scanned_at'] if row is not None else None
+
+    def put_last_scan(self, api_uri):
+        self.conn.execute("INSERT OR REPLACE INTO board_scan (api_uri, scanned_at) VALUES (?, ?)",
+                          (api_uri, time.time()))
+
+    def clear(self):
+        self.conn.execute("DELETE FROM card")
+        self.conn.execute("DELETE FROM unmapped_card")
+        self.conn.execute("DELETE FROM board_scan")
+        self.clear_board_details()
+        self.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
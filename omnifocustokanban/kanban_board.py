@@ -1,22 +1,55 @@
 import logging
-import yaml
 import os
-from kanban_flow_board import KanbanFlowBoard
+from kanban_flow_board import KanbanFlowBoard, DEFAULT_MAX_WORKERS, API_URI, DEFAULT_BOARD_CACHE_TTL, \
+    DEFAULT_RECONCILE_INTERVAL, DEFAULT_REQUEST_TIMEOUT
+from id_store import IdStore
+from omnifocus import card_type_index, card_type
+
+CONFIG_PATH = "./config/kanbanflow-config.yaml"
+DEFAULT_ID_STORE = "./config/kanbanflow-ids.db"
+BOARD_ID_STORE = "./config/kanbanflow-ids-{0}.db"
 
 
 class KanbanFlow:
     kb = None
     log = logging.getLogger(__name__)
 
-    def __init__(self):
-        self.config = load_config("./config/kanbanflow-config.yaml")
+    def __init__(self, rebuild_ids=False, metrics=None, refresh_board=False, close_only=False, config=None):
+        self.metrics = metrics
+        self.close_only = close_only
+        self.config = config if config is not None else load_config(CONFIG_PATH)
 
         token = self.config['token']
         default_drop_lane = self.config['default_drop_lane']
         types = self.config['card_types']
         completed_columns = self.config['completed_lanes']
 
-        self.kb = KanbanFlowBoard(token, default_drop_lane, types, completed_columns)
+        self.id_store = IdStore(self.config.get('id_store', DEFAULT_ID_STORE))
+        if rebuild_ids:
+            self.log.debug("Rebuilding ID store from board comments")
+            self.id_store.clear()
+        elif refresh_board:
+            self.log.debug("Discarding cached board layout")
+            self.id_store.clear_board_details()
+            self.id_store.commit()
+
+        self.kb = self.create_board(token, default_drop_lane, types, completed_columns)
+
+    def create_board(self, token, default_drop_lane, types, completed_columns):
+        max_workers = self.config.get('max_workers', DEFAULT_MAX_WORKERS)
+        return KanbanFlowBoard(token, default_drop_lane, types, completed_columns, self.id_store, max_workers,
+                               self.config.get('api_uri', API_URI), self.metrics,
+                               self.config.get('board_cache_ttl', DEFAULT_BOARD_CACHE_TTL),
+                               completed_columns if self.close_only else None, self.open_event_queue(),
+                               self.config.get('reconcile_interval', DEFAULT_RECONCILE_INTERVAL),
+                               self.config.get('request_timeout', DEFAULT_REQUEST_TIMEOUT))
+
+    def open_event_queue(self):
+        """The queue --receive-webhooks writes KanbanFlow events to, if the config sets one."""
+        if not self.config.get('event_queue'):
+            return None
+        from event_queue import EventQueue
+        return EventQueue(self.config['event_queue'])
 
     def find_completed_card_ids(self):
         return self.kb.completed_tasks
@@ -26,16 +59,100 @@ class KanbanFlow:
 
     def add_cards(self, cards):
         cards_added = self.kb.create_tasks(cards)
-        self.log.debug("Made {0} API requests in this session ({1} total bytes)".format(self.kb.api_requests,
-                                                                                        self.kb.bytes_transferred))
+        self.log.debug("Made {0} API requests in this session ({1} total bytes)".format(
+            self.kb.metrics.api_requests, self.kb.metrics.bytes_transferred))
         return cards_added
 
-    def remove_comments_from_repeating_tasks(self, identifiers):
+    def verify_ids(self):
+        return self.kb.verify_id_store()
+
+    def remove_ids_from_repeating_tasks(self, identifiers):
         for _id in identifiers:
-            self.kb.delete_external_id_comment(_id['id'])
+            self.kb.remove_external_id(_id['id'])
+
+    def migrate_ids(self, dry_run=False):
+        """Move external IDs from card comments into card descriptions, or with dry_run just list the cards."""
+        if dry_run:
+            return self.kb.cards_to_migrate()
+        return self.kb.migrate_external_ids()
+
+
+class AsyncKanbanFlow(KanbanFlow):
+    """KanbanFlow wrapper around AsyncKanbanFlowBoard; call connect() before using the board."""
+
+    def create_board(self, token, default_drop_lane, types, completed_columns):
+        from async_kanban_flow_board import AsyncKanbanFlowBoard, DEFAULT_REQUESTS_PER_MINUTE
+
+        requests_per_minute = self.config.get('requests_per_minute', DEFAULT_REQUESTS_PER_MINUTE)
+        return AsyncKanbanFlowBoard(token, default_drop_lane, types, self.id_store, requests_per_minute,
+                                    api_uri=self.config.get('api_uri', API_URI), metrics=self.metrics,
+                                    board_cache_ttl=self.config.get('board_cache_ttl', DEFAULT_BOARD_CACHE_TTL),
+                                    request_timeout=self.config.get('request_timeout', DEFAULT_REQUEST_TIMEOUT))
+
+    async def connect(self):
+        await self.kb.load(self.config['completed_lanes'])
+
+    async def close(self):
+        await self.kb.close()
+
+    async def add_cards(self, cards):
+        cards_added = await self.kb.create_tasks(cards)
+        self.log.debug("Made {0} API requests in this session ({1} total bytes)".format(
+            self.kb.metrics.api_requests, self.kb.metrics.bytes_transferred))
+        return cards_added
+
+    async def remove_ids_from_repeating_tasks(self, identifiers):
+        import asyncio
+        await asyncio.gather(*(self.kb.remove_external_id(_id['id']) for _id in identifiers))
+
+
+def board_configs(config):
+    """Split a config into one config per board.
+
+    A config with a boards list syncs each of them; every other top-level key is a default the boards can override.
+    Each board needs a unique name, which also names its ID store unless it sets id_store. A config without boards is
+    a single board. event_queue is refused with boards, since --receive-webhooks only fills a single board's queue.
+    """
+    boards = config.get('boards')
+    if not boards:
+        return [config]
+
+    if config.get('event_queue') or any(board.get('event_queue') for board in boards):
+        # an unfilled queue would leave each board reading just its ID store until reconcile_interval
+        raise ValueError("event_queue only supports a config with a single board")
+
+    defaults = dict((key, value) for key, value in config.items() if key not in ('boards', 'id_store'))
+    configs = []
+    for index, board in enumerate(boards):
+        merged = dict(defaults, **board)
+        merged.setdefault('name', "board{0}".format(index + 1))
+        merged.setdefault('id_store', BOARD_ID_STORE.format(merged['name']))
+        configs.append(merged)
+
+    names = [merged['name'] for merged in configs]
+    if len(set(names)) != len(names):
+        raise ValueError("Board names must be unique: {0}".format(", ".join(names)))
+    return configs
+
+
+def board_tasks(config, tasks):
+    """The tasks for a board, typed by its own card types: those with a tag in its tags list that is one of them, or
+    with any of them if it doesn't have one. A task whose type differs on this board is copied, not changed."""
+    if not config.get('card_types'):
+        raise ValueError("Board {0} has no card_types".format(config.get('name')))
+    type_index = card_type_index(config['card_types'], config.get('tags'))
+    selected = []
+    for task in tasks:
+        _type = card_type(task.tags, type_index)
+        if _type is None:
+            continue
+        selected.append(task if _type == task.type else task.with_type(_type))
+    return selected
 
 
 def load_config(path):
+    import yaml
+
     path = "{0}/{1}".format(os.getcwd(), path)
     logging.debug("Loading config file {0}".format(path))
     f = open(path)
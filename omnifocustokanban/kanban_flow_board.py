@@ -1,10 +1,34 @@
 import requests
 import logging
 import base64
-from operator import itemgetter
-
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from sync_metrics import SyncMetrics
+from sync_plan import CardCreate, CardUpdate
+
+# cards carry their Omnifocus ID at the end of their description, so the task listing alone maps the board; cards
+# synced before that keep it in a comment starting with COMMENT_PREFIX until --migrate-ids moves it
+ID_MARKER = u"[external_id={0}]"
+# only the separator with_id_marker puts before the marker is stripped with it; whitespace before that is the note's
+ID_MARKER_PATTERN = re.compile(r"(?:\n\n)?\[external_id=([^\]\s]+)\]\s*$")
 COMMENT_PREFIX = "external_id="
-TASKS_URI = "https://kanbanflow.com/api/v1/tasks/"
+API_URI = "https://kanbanflow.com/api/v1/"
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_BOARD_CACHE_TTL = 3600
+# with an event queue, how often the whole board is still read in case a webhook event went missing
+DEFAULT_RECONCILE_INTERVAL = 6 * 3600
+# KanbanFlow webhook event types that carry a task's new state; taskDeleted removes it
+TASK_EVENTS = ("taskCreated", "taskChanged", "taskMoved")
+# KanbanFlow's maximum page size for GET /tasks
+TASKS_PAGE_SIZE = 100
+# (connect, read) seconds before a KanbanFlow request is given up on, so a stalled connection can't hang --watch
+DEFAULT_REQUEST_TIMEOUT = (5, 30)
 
 
 class KanbanFlowBoard:
@@ -12,80 +36,368 @@ class KanbanFlowBoard:
     auth = None
     default_drop_column = None
     board_details = None
-    all_tasks = {}
-    completed_tasks = []
-    api_requests = 0
-    bytes_transferred = 0
 
-    def __init__(self, token, default_drop_column, types, completed_columns):
+    def __init__(self, token, default_drop_column, types, completed_columns, id_store=None,
+                 max_workers=DEFAULT_MAX_WORKERS, api_uri=API_URI, metrics=None,
+                 board_cache_ttl=DEFAULT_BOARD_CACHE_TTL, load_columns=None, event_queue=None,
+                 reconcile_interval=DEFAULT_RECONCILE_INTERVAL, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.id_store = id_store
+        self.metrics = metrics if metrics is not None else SyncMetrics()
+        self.api_uri = api_uri
+        self.board_uri = api_uri + "board"
+        self.tasks_uri = api_uri + "tasks/"
+        self.synced_fingerprints = []
+        self.changed_cards = []
+        self.failed_cards = []
+        self.all_tasks = {}
+        self.completed_tasks = []
+        # the layout, filled in by load_board_details
+        self.columns = {}
+        self.swimlanes = {}
+        self.colors = set()
         auth = base64.b64encode("apiToken:{0}".format(token).encode()).decode("utf-8")
         self.auth = {'Authorization': "Basic {0}".format(auth)}
-        self.board_details = self.request("https://kanbanflow.com/api/v1/board")
-        self.default_swimlane = self.board_details['swimlanes'][0]['uniqueId']
+        self.max_workers = max_workers
+        self.session = None
+        self.request_timeout = request_timeout_parts(request_timeout)
+        self.board_cache_ttl = board_cache_ttl
         self.default_drop_column = default_drop_column
         self.types = types
-        self.classify_board(completed_columns)
-
-    def classify_board(self, completed_columns):
-        columns = self.request(TASKS_URI)
-
-        for column in columns:
-            column_id = column["columnId"]
-            column_name = column["columnName"]
-            tasks = column["tasks"]
+        self.completed_columns = completed_columns
+        # None reads every column; a close-only run just needs the completed lanes
+        self.load_columns = load_columns
+        # webhook events for this board, see load_board; needs an ID store to keep the cards in
+        self.event_queue = event_queue if id_store is not None else None
+        self.reconcile_interval = reconcile_interval
+        self.connect()
+
+    def connect(self):
+        """Open the pooled session and read the board: its layout, then its cards."""
+        self.session = requests.Session()
+        self.session.headers.update(self.auth)
+        self.session.headers['Accept-Encoding'] = "gzip"
+        self.session.mount(self.api_uri, HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+        self.load_board_details()
+        self.load_board()
+
+    def refresh(self):
+        """Reload the board snapshot, e.g. to pick up cards moved into a completed lane since the last load."""
+        self.all_tasks = {}
+        self.completed_tasks = []
+        self.load_board_details()
+        self.load_board()
+
+    def load_board(self):
+        """Find the cards on the board and which of them are in a completed lane.
+
+        With an event queue the cards come from their last known state in the ID store with the queued webhook events
+        applied, and the board is only read from the API every reconcile_interval seconds, in case an event was lost.
+        """
+        if self.event_queue is None:
+            self.classify_board(self.completed_columns, self.load_columns)
+            return
+
+        if not self.reconciliation_due() and self.apply_events():
+            return
+
+        # events that arrive while the board is read may be newer than what's read, so they're kept for next time
+        last_event_id = self.event_queue.last_id()
+        self.classify_board(self.completed_columns, self.load_columns)
+        if self.load_columns is None:
+            self.id_store.put_last_scan(self.api_uri)
+            self.id_store.commit()
+            self.event_queue.ack(last_event_id)
+
+    def reconciliation_due(self):
+        last_scan = self.id_store.get_last_scan(self.api_uri)
+        return last_scan is None or time.time() - last_scan >= self.reconcile_interval
+
+    def apply_events(self):
+        """Apply the queued events to the cards stored in the ID store and load the result; False (and nothing
+        loaded) if a card has no stored state, so the board has to be read instead."""
+        events = self.event_queue.pending()
+        for _, event in events:
+            self.apply_event(event)
+        self.id_store.commit()
+
+        cards = self.id_store.card_details()
+        if cards is None:
+            self.log.debug("ID store is missing card details, reading the board")
+            return False
+        if events:
+            # applying an event twice does no harm, so they're only dropped once the ID store has them
+            self.event_queue.ack(events[-1][0])
+
+        for external_id, column_id, task in cards:
+            self.add_board_task(task, external_id, column_id in self.completed_columns)
+        self.log.debug("Loaded {0} cards from the ID store after {1} event(s)".format(len(cards), len(events)))
+        return True
+
+    def apply_event(self, event):
+        event_type = event.get("eventType")
+        task = event.get("task") or {}
+        task_id = task.get("_id") or event.get("taskId")
+        if task_id is None:
+            return
+
+        if event_type == "taskDeleted":
+            self.id_store.remove_task(task_id)
+        elif event_type in TASK_EVENTS:
+            entry = self.id_store.get_by_task_id(task_id)
+            details = json.loads(entry["details"]) if entry is not None and entry["details"] else {}
+            if entry is None:
+                # a card without an external ID doesn't matter to the sync; the next full read looks for a comment
+                external_id = description_external_id(task)
+                if external_id is None or "columnId" not in task:
+                    return
+                self.id_store.put(external_id, task_id, None, task["columnId"])
+                entry = self.id_store.get_by_task_id(task_id)
+            details.update(task)
+            self.id_store.put_details(task_id, details.get("columnId", entry["column_id"]), details)
+
+    def load_board_details(self):
+        """Load the columns, swimlanes and colours from the cache in the ID store, or from /board once the cache is
+        older than board_cache_ttl, and check the configured lanes and card types against them."""
+        if not self.use_cached_board_details():
+            with self.metrics.phase("board_load"):
+                details = self.request(self.board_uri)
+            self.use_fetched_board_details(details)
+
+    def use_cached_board_details(self):
+        """Use the cached board layout if there is one and the config matches it; False if /board has to be read."""
+        details = self.cached_board_details()
+        if details is None:
+            return False
+        self.use_board_details(details)
+        if self.validate_board():
+            # the board may have changed since its layout was cached, so check the live one before giving up
+            self.log.debug("Cached board layout doesn't match the config, reloading it")
+            return False
+        return True
+
+    def use_fetched_board_details(self, details):
+        """Cache and use the layout read from /board, failing if it couldn't be read or the config doesn't match."""
+        if details is None:
+            raise IOError("Couldn't load KanbanFlow board details")
+        self.store_board_details(details)
+        self.use_board_details(details)
+        problems = self.validate_board()
+        if problems:
+            raise ValueError("Config doesn't match the KanbanFlow board: {0}".format("; ".join(problems)))
+
+    def cached_board_details(self):
+        if self.id_store is None or not self.board_cache_ttl:
+            return None
+        return self.id_store.get_board_details(self.api_uri, self.board_cache_ttl)
+
+    def store_board_details(self, details):
+        if self.id_store is not None and self.board_cache_ttl:
+            self.id_store.put_board_details(self.api_uri, details)
+            self.id_store.commit()
+
+    def use_board_details(self, details):
+        self.board_details = details
+        self.columns = dict((column['uniqueId'], column) for column in details['columns'])
+        self.swimlanes = dict((swimlane['uniqueId'], swimlane) for swimlane in details['swimlanes'])
+        self.colors = set(color['value'] for color in details.get('colors') or [])
+        self.default_swimlane = details['swimlanes'][0]['uniqueId']
+
+    def validate_board(self):
+        """List the ways default_drop_lane, completed_lanes and card_types don't match the board layout."""
+        problems = []
+        if self.default_drop_column not in self.columns:
+            problems.append("default_drop_lane {0} isn't a column".format(self.default_drop_column))
+        for column_id in self.completed_columns or []:
+            if column_id not in self.columns:
+                problems.append("completed lane {0} isn't a column".format(column_id))
+        for _type, type_config in (self.types or {}).items():
+            if 'column' in type_config and type_config['column'] not in self.columns:
+                problems.append("card type {0} column {1} isn't a column".format(_type, type_config['column']))
+            # boards that don't list their colours can't be checked
+            if self.colors and type_config.get('color') not in self.colors:
+                problems.append("card type {0} colour {1} isn't one of {2}".format(
+                    _type, type_config.get('color'), ", ".join(sorted(self.colors))))
+        return problems
+
+    def classify_board(self, completed_columns, column_ids=None):
+        """Match the cards in column_ids (every column by default) to Omnifocus IDs, a page of tasks at a time."""
+        board_task_ids = set()
+        unread = []
+
+        for column_id, tasks in self.iter_task_pages(column_ids):
             is_completed_column = column_id in completed_columns
+            unknown_tasks = self.classify_known_tasks(tasks, column_id, is_completed_column, board_task_ids)
 
-            # self.log.debug(u"Found {0} tasks in {1} (completed column? {2})".format(len(tasks), column_name,
-            #                                                                         is_completed_column))
+            # comment lookups are independent of each other, so fetch a page's worth together
+            with self.metrics.phase("comment_scan"):
+                lookups = self.map(self.get_comment_containing_id, [task["_id"] for task in unknown_tasks])
+            unread.extend(self.classify_looked_up_tasks(unknown_tasks, lookups, column_id, is_completed_column))
 
-            for task in tasks:
-                _id = task["_id"]
-                # self.log.debug("{0}".format("Parsing task {0}".format(task["name"])))
-                comment = self.get_comment_containing_id(_id)
+        self.finish_classifying(board_task_ids, unread, column_ids)
 
-                if comment is not None:
-                    external_id = comment["text"][len(COMMENT_PREFIX):]
-                    self.all_tasks[external_id] = task
-                    if is_completed_column:
-                        self.completed_tasks.append({"id": external_id, "name": task["name"]})
+    def classify_known_tasks(self, tasks, column_id, is_completed_column, board_task_ids):
+        """Add a page's cards whose external ID is in their description or the ID store to the snapshot, returning
+        those that need a comment lookup."""
+        unknown_tasks = []
+        for task in tasks:
+            board_task_ids.add(task["_id"])
+            known, external_id = self.find_stored_external_id(task, column_id)
+            if known:
+                self.add_board_task(task, external_id, is_completed_column)
+                self.store_card_details(task, external_id, column_id)
+            else:
+                unknown_tasks.append(task)
+        return unknown_tasks
+
+    def classify_looked_up_tasks(self, tasks, lookups, column_id, is_completed_column):
+        """Add cards whose comments were looked up, with the (read, comment) of each, returning the task IDs of
+        those whose comments couldn't be read."""
+        unread = []
+        for task, (read, comment) in zip(tasks, lookups):
+            if not read:
+                unread.append(task["_id"])
+                continue
+            external_id = self.store_external_id(task["_id"], column_id, comment)
+            self.add_board_task(task, external_id, is_completed_column)
+            self.store_card_details(task, external_id, column_id)
+        return unread
+
+    def finish_classifying(self, board_task_ids, unread, column_ids=None):
+        if self.id_store is not None:
+            # cards in columns that weren't read are still on the board, so only a full read can find stale ones
+            if column_ids is None:
+                self.id_store.retain_task_ids(board_task_ids)
+            self.id_store.commit()
+        check_comments_read(unread)
+
+    def add_board_task(self, task, external_id, is_completed_column):
+        if external_id is None:
+            return
+        self.all_tasks[external_id] = task
+        if is_completed_column:
+            self.completed_tasks.append({"id": external_id, "name": task["name"]})
+
+    def store_card_details(self, task, external_id, column_id):
+        """Keep a card's task JSON in the ID store for event-driven loads; only needed with an event queue."""
+        if self.event_queue is not None and external_id is not None:
+            self.id_store.put_details(task["_id"], column_id, task)
+
+    def iter_task_pages(self, column_ids=None):
+        """Yield (column ID, tasks) a page at a time for each of column_ids, or every column in board order."""
+        for column_id, swimlane_id in self.task_lanes(column_ids):
+            start_task_id = None
+            while True:
+                with self.metrics.phase("board_load"):
+                    page = self.request(self.tasks_uri + "?" + task_page_query(column_id, start_task_id, swimlane_id))
+                entries = column_pages(page, column_id)
+                for entry in entries:
+                    yield column_id, entry.get("tasks") or []
+
+                start_task_id = next_task_id(entries)
+                if start_task_id is None:
+                    break
+
+    def task_lanes(self, column_ids=None):
+        """(column ID, swimlane ID) for each lane to page through, swimlane ID None on a board with one swimlane.
+
+        KanbanFlow answers GET /tasks?columnId= with an entry per swimlane, but only pages within the swimlane named
+        by swimlaneId, so a board with swimlanes is read a swimlane at a time.
+        """
+        if column_ids is None:
+            column_ids = list(self.columns)
+        swimlane_ids = list(self.swimlanes) if len(self.swimlanes) > 1 else [None]
+        return [(column_id, swimlane_id) for column_id in column_ids for swimlane_id in swimlane_ids]
+
+    def iter_board_tasks(self, column_ids=None):
+        """Yield (column ID, task) for every card in column_ids, or on the board, without holding them all."""
+        for column_id, tasks in self.iter_task_pages(column_ids):
+            for task in tasks:
+                yield column_id, task
+
+    def find_stored_external_id(self, task, column_id):
+        """(known, external ID) from the card's description or the ID store; known is False if only a comment
+        lookup can tell."""
+        _id = task["_id"]
+
+        external_id = description_external_id(task)
+        if external_id is not None:
+            if self.id_store is not None:
+                entry = self.id_store.get_by_task_id(_id)
+                if entry is None or entry["external_id"] != external_id or entry["column_id"] != column_id:
+                    # a comment the card still has from before its migration stays known, so it can be removed
+                    comment_id = entry["comment_id"] if entry is not None and entry["external_id"] == external_id \
+                        else None
+                    self.id_store.put(external_id, _id, comment_id, column_id)
+            return True, external_id
+
+        if self.id_store is not None:
+            entry = self.id_store.get_by_task_id(_id)
+            if entry is not None:
+                if entry["column_id"] != column_id:
+                    self.id_store.put(entry["external_id"], _id, entry["comment_id"], column_id)
+                return True, entry["external_id"]
+            if self.id_store.is_unmapped(_id):
+                return True, None
+
+        return False, None
+
+    def store_external_id(self, _id, column_id, comment):
+        """Record what the comment lookup of a card found; a card without an external_id comment isn't looked up
+        again."""
+        if comment is None:
+            if self.id_store is not None:
+                self.id_store.put_unmapped(_id)
+            return None
+
+        external_id = comment["text"][len(COMMENT_PREFIX):]
+        if self.id_store is not None:
+            self.id_store.put(external_id, _id, comment["_id"], column_id)
+        return external_id
 
     def get_comment_containing_id(self, _id):
-        # self.log.debug("Looking for comments in task {0}".format(_id))
+        """(read, comment): the card's external_id comment, or None if it has none. read is False if the comments
+        couldn't be fetched (a 429, 5xx or connection error), since that says nothing about whether it has one."""
         try:
-            comment_json = self.request(TASKS_URI + "{0}/comments".format(_id))
-            if comment_json:
-                comment = next((item for item in comment_json if COMMENT_PREFIX in item["text"]))
-                if comment:
-                    return comment
-        except:
-            self.log.warning("Failed to get comments for {0}".format(_id))
-        return None
+            comment_json = self.request(self.tasks_uri + "{0}/comments".format(_id))
+        except ValueError:
+            comment_json = None
+        return self.comment_lookup(_id, comment_json)
+
+    def comment_lookup(self, _id, comment_json):
+        """(read, comment) from the response to a card's comments request, None if the request failed."""
+        try:
+            if comment_json is not None:
+                return True, find_id_comment(comment_json)
+        except (KeyError, TypeError):
+            pass
+        self.log.warning("Failed to get comments for {0}".format(_id))
+        return False, None
 
     def create_tasks(self, tasks):
         self.log.debug(u"Checking which of {0} tasks to add".format(len(tasks)))
 
-        tasks_added = 0
-        external_ids = self.all_tasks.keys()
-
-        for task in tasks:
-            name = task['name']
-            identifier = task['identifier']
-            _type = task['type']
-            note = task['note']
-            subtasks = None
+        items = [item for item in (self.plan_task(task) for task in tasks) if item is not None]
+        creates = [item for item in items if isinstance(item, CardCreate)]
+        updates = [item for item in items if isinstance(item, CardUpdate)]
 
-            if 'children' in task:
-                subtasks = task['children']
+        tasks_added = self.execute_creates(creates)
+        tasks_added += sum(self.map(self.execute_update, updates))
+        self.commit_fingerprints()
+        return tasks_added
 
-            if identifier in external_ids:
-                tasks_added += self.update_task(identifier, name, note, subtasks)
-            else:
-                tasks_added += self.create_task(name, self.default_drop_column, identifier, None, note, _type,
-                                                subtasks)
+    def plan_task(self, task):
+        """Work out the CardCreate or CardUpdate for an Omnifocus task, or None if its card is up to date."""
+        identifier = task.identifier
+        subtasks = sorted(task.children or [], key=attrgetter('name'))
+        fingerprint = task_fingerprint(task.name, task.note, subtasks)
 
-        return tasks_added
+        if identifier in self.all_tasks:
+            return self.plan_update(identifier, task.name, task.note, subtasks, fingerprint=fingerprint)
+        return self.plan_create(task.name, self.default_drop_column, identifier, None, task.note, task.type,
+                                subtasks, fingerprint)
 
-    def create_task(self, name, column, identifier, swimlane, description='', _type=None, subtasks=None):
+    def plan_create(self, name, column, identifier, swimlane, description='', _type=None, subtasks=None,
+                    fingerprint=None):
         if 'None' == _type:
             raise ValueError("Task '{0}' can't have context value of 'None'".format(name))
 
@@ -101,128 +413,323 @@ class KanbanFlowBoard:
             if 'column' in type_config:
                 column = type_config['column']
 
-        updates_made = 0
-
         if swimlane is None:
             swimlane = self.default_swimlane
 
-        if "Look" in name:
-            print("here")
-
-        properties = {"name": name, "columnId": column, "description": description,
+        properties = {"name": name, "columnId": column, "description": with_id_marker(description, identifier),
                       "color": color, "swimlaneId": swimlane}
-        # properties = {"name": name, "columnId": column, "description": description,
-        #               "color": color}
-        comment = COMMENT_PREFIX + identifier
-
-        json = self.request("https://kanbanflow.com/api/v1/tasks", properties)
-        self.log.debug(u"{0}".format(json))
-        if json is not None:
-            self.log.debug(u"Adding task: {0}".format(properties))
-            task_id = json["taskId"]
-            updates_made += 1
-            self.request(TASKS_URI + "{0}/comments".format(task_id), {"text": comment})
-        else:
-            self.log.error(u"Task add failed: {0}".format(properties))
-
-        if subtasks:
-            sorted_subtasks = sorted(subtasks, key=itemgetter('name'))
-            for subtask in sorted_subtasks:
-                self.log.debug(u"Adding subtask '{0}' to task {1} with id {2}".format(subtask, name, task_id))
-                self.create_subtask(task_id, subtask)
-                updates_made += 1
+        return CardCreate(identifier, properties, subtasks or [], fingerprint)
 
-        return updates_made
-
-    def delete_external_id_comment(self, identifier):
+    def plan_update(self, identifier, name, note, subtasks=None, existing_subtask_names=None, fingerprint=None):
         task = self.all_tasks[identifier]
-        task_id = task['_id']
-
-        comment = self.get_comment_containing_id(task_id)
-
-        if comment is not None:
-            comment_id = comment["_id"]
-            requests.delete(TASKS_URI + "{0}/comments/{1}".format(task_id, comment_id), headers=self.auth)
-
-    def create_subtask(self, task_id, subtask):
-        name = subtask['name']
-        completed = subtask['completed']
-        if not completed:
-            completed = False
-        uri = TASKS_URI + "{0}/subtasks".format(task_id)
-        body = {"name": name, "finished": completed}
-        json = self.request(uri, body)
-
-    def update_task(self, identifier, name, note, subtasks=None):
-        task = self.all_tasks[identifier]
-        task_id = task['_id']
-        existing_subtask_names = self.get_subtasks(task_id)
+        task_id, _ = self.get_stored_ids(identifier)
+        subtasks = subtasks or []
         properties = {}
-        updates_made = 0
+
+        # an unchanged fingerprint means the card already has every subtask, so there's no need to list them
+        stored_fingerprint = self.get_stored_fingerprint(identifier)
+        if fingerprint is not None and fingerprint == stored_fingerprint:
+            subtasks = []
 
         if task['name'] != name:
             properties['name'] = name
-        if compare_description(task['description'], note):
-            properties['description'] = note
+        if compare_description(strip_id_marker(task.get('description')), note):
+            properties['description'] = with_id_marker(note, identifier)
+
+        if existing_subtask_names is None and 'subTasks' in task:
+            existing_subtask_names = [sub_task['name'] for sub_task in task['subTasks']]
+        if existing_subtask_names is not None:
+            subtasks = [subtask for subtask in subtasks if subtask.name not in existing_subtask_names]
 
         if not len(properties) and not subtasks:
             self.log.debug(u"Nothing to update in task {0} '{1}'".format(identifier, name))
-            return updates_made
+            if fingerprint is not None and fingerprint != stored_fingerprint:
+                self.synced_fingerprints.append((identifier, fingerprint))
+            return None
+
+        return CardUpdate(identifier, task_id, name, properties, subtasks, existing_subtask_names, fingerprint)
+
+    def create_task(self, name, column, identifier, swimlane, description='', _type=None, subtasks=None):
+        subtasks = sorted(subtasks or [], key=attrgetter('name'))
+        create = self.plan_create(name, column, identifier, swimlane, description, _type, subtasks,
+                                  task_fingerprint(name, description, subtasks))
+        updates_made = self.execute_create(create)
+        self.commit_fingerprints()
+        return updates_made
+
+    def execute_creates(self, creates):
+        """Create cards in order, so they land on the board in that order."""
+        return sum(self.execute_create(create) for create in creates)
+
+    def execute_create(self, create):
+        """Create a card in one request: its subtasks are in the body and its external ID in its description."""
+        json = self.request(self.api_uri + "tasks", create_body(create))
+        self.log.debug(u"{0}".format(json))
+        return self.record_create(create, json)
+
+    def record_create(self, create, response):
+        """Add a created card to the snapshot and ID store, or count it as failed if response is None; returns the
+        updates made."""
+        identifier = create.identifier
+        column = create.properties['columnId']
+        if response is None:
+            self.log.error(u"Task add failed: {0}".format(create.properties))
+            self.failed_cards.append(identifier)
+            return 0
+
+        self.log.debug(u"Adding task with {0} subtask(s): {1}".format(len(create.subtasks), create.properties))
+        task_id = response["taskId"]
+        # the subtasks are on the snapshot too, so a later update doesn't have to list them
+        self.all_tasks[identifier] = dict(create_body(create), _id=task_id)
+        if self.id_store is not None:
+            self.id_store.put(identifier, task_id, None, column)
+            self.store_card_details(self.all_tasks[identifier], identifier, column)
+            self.id_store.commit()
+
+        if create.fingerprint is not None:
+            self.synced_fingerprints.append((identifier, create.fingerprint))
+        return 1 + len(create.subtasks)
+
+    def has_embedded_id(self, identifier):
+        task = self.all_tasks.get(identifier)
+        return task is not None and description_external_id(task) is not None
+
+    def remove_external_id(self, identifier):
+        """Take the external ID off a card, e.g. once its repeating task was closed, so the task's next occurrence
+        gets a card of its own: the description marker, and the comment of a card that predates it."""
+        task_id, comment_id = self.get_stored_ids(identifier)
+
+        task = self.all_tasks.get(identifier)
+        if self.has_embedded_id(identifier):
+            description = strip_id_marker(task.get('description'))
+            if self.request(self.tasks_uri + "{0}".format(task_id), {"description": description}) is not None:
+                task['description'] = description
+        elif comment_id is None:
+            _, comment = self.get_comment_containing_id(task_id)
+            if comment is not None:
+                comment_id = comment["_id"]
+
+        if comment_id is not None:
+            self.delete(self.tasks_uri + "{0}/comments/{1}".format(task_id, comment_id))
+        self.forget_card(task_id)
+
+    def forget_card(self, task_id):
+        """Remember that a card has no external ID any more, so it's neither synced nor looked up again."""
+        if self.id_store is not None:
+            self.id_store.put_unmapped(task_id)
+            self.id_store.commit()
+
+    def get_stored_ids(self, identifier):
+        if self.id_store is not None:
+            entry = self.id_store.get(identifier)
+            if entry is not None:
+                return entry["task_id"], entry["comment_id"]
+        return self.all_tasks[identifier]['_id'], None
+
+    def verify_id_store(self):
+        """Check every stored mapping against its card's description, or the comment on cards that predate the
+        description marker, returning the external IDs that drifted."""
+        mismatches = []
+        embedded = dict((task["_id"], description_external_id(task)) for _, task in self.iter_board_tasks())
+        entries = self.id_store.all()
+        legacy = [entry["task_id"] for entry in entries if embedded.get(entry["task_id"]) is None]
+        lookups = dict(zip(legacy, self.map(self.get_comment_containing_id, legacy)))
+        check_comments_read([task_id for task_id, (read, _) in lookups.items() if not read])
+        comments = dict((task_id, comment) for task_id, (_, comment) in lookups.items())
+        for entry in entries:
+            external_id = entry["external_id"]
+            if entry["task_id"] in comments:
+                comment = comments[entry["task_id"]]
+                matches = comment is not None and comment["text"][len(COMMENT_PREFIX):] == external_id \
+                    and entry["comment_id"] in (None, comment["_id"])
+            else:
+                matches = embedded[entry["task_id"]] == external_id
+            if not matches:
+                self.log.warning(u"ID store entry for {0} (task {1}) doesn't match the board".format(
+                    external_id, entry["task_id"]))
+                mismatches.append(external_id)
+        return mismatches
+
+    def cards_to_migrate(self):
+        """External IDs of the cards that still keep theirs in a comment rather than their description."""
+        return [identifier for identifier in self.all_tasks if not self.has_embedded_id(identifier)]
+
+    def migrate_external_ids(self):
+        """Move every card's external ID from its comment into its description and delete the comment, returning
+        the external IDs moved."""
+        cards = [(identifier,) + self.get_stored_ids(identifier) for identifier in self.cards_to_migrate()]
+        results = self.map(self.migrate_card, cards)
+
+        migrated = []
+        for (identifier, task_id, _), description in zip(cards, results):
+            if description is None:
+                continue
+            task = self.all_tasks[identifier]
+            task['description'] = description
+            if self.id_store is not None:
+                entry = self.id_store.get(identifier)
+                column_id = entry["column_id"] if entry is not None else task.get("columnId")
+                self.id_store.put(identifier, task_id, None, column_id)
+                self.store_card_details(task, identifier, column_id)
+            migrated.append(identifier)
+
+        if self.id_store is not None:
+            self.id_store.commit()
+        self.log.debug("Moved {0} of {1} external IDs into card descriptions".format(len(migrated), len(cards)))
+        return migrated
+
+    def migrate_card(self, card):
+        """Runs on a worker thread: add the marker to the card's description, then delete the comment. Returns the
+        new description, or None if the card couldn't be updated."""
+        identifier, task_id, comment_id = card
+        # the comment is found first: once the description has the marker, the card isn't offered for migration again
+        if comment_id is None:
+            read, comment = self.get_comment_containing_id(task_id)
+            if not read:
+                self.log.error(u"Couldn't read the comments of card {0}, {1} is left for the next migration".format(
+                    task_id, identifier))
+                return None
+            comment_id = comment["_id"] if comment is not None else None
+
+        description = with_id_marker(self.all_tasks[identifier].get('description'), identifier)
+        if self.request(self.tasks_uri + "{0}".format(task_id), {"description": description}) is None:
+            self.log.error(u"Couldn't move the external ID of {0} into card {1}".format(identifier, task_id))
+            return None
+
+        if comment_id is not None:
+            self.delete(self.tasks_uri + "{0}/comments/{1}".format(task_id, comment_id))
+        return description
+
+    def create_subtask(self, task_id, subtask):
+        uri = self.tasks_uri + "{0}/subtasks".format(task_id)
+        return self.request(uri, subtask_body(subtask))
+
+    def update_task(self, identifier, name, note, subtasks=None, existing_subtask_names=None):
+        subtasks = sorted(subtasks or [], key=attrgetter('name'))
+        update = self.plan_update(identifier, name, note, subtasks, existing_subtask_names,
+                                  task_fingerprint(name, note, subtasks))
+        updates_made = 0
+        if update is not None:
+            updates_made = self.execute_update(update)
+        self.commit_fingerprints()
+        return updates_made
+
+    def execute_update(self, update):
+        task_id = update.task_id
+        updates_made = 0
+        synced = True
 
-        if len(properties):
-            self.log.debug(u"Updating pre-existing task {0} '{1}'".format(identifier, name))
-            self.request(TASKS_URI + "{0}".format(task_id), properties)
+        if len(update.properties):
+            self.log.debug(u"Updating pre-existing task {0} '{1}'".format(update.identifier, update.name))
+            synced = self.request(self.tasks_uri + "{0}".format(task_id), update.properties) is not None
+            self.record_properties_update(update, synced)
             updates_made += 1
 
-        if subtasks:
-            sorted_subtasks = sorted(subtasks, key=itemgetter('name'))
-            self.log.debug(u"Existing sub-tasks in {0}, {1}: {2}".format(identifier, name, sorted_subtasks))
-            for subtask in sorted_subtasks:
-                subtask_name = subtask['name']
-                if subtask_name not in existing_subtask_names:
-                    self.log.debug(u"Adding new subtask '{0}' to '{1}'".format(subtask_name, name))
-                    self.create_subtask(task_id, subtask)
-                    updates_made += 1
+        if update.subtasks:
+            existing_subtask_names = update.existing_subtask_names
+            if existing_subtask_names is None:
+                existing_subtask_names = self.get_subtasks(task_id)
+            subtasks = self.subtasks_to_add(update, existing_subtask_names)
+            if subtasks is None:
+                return updates_made
+            for subtask in subtasks:
+                synced = self.create_subtask(task_id, subtask) is not None and synced
+                updates_made += 1
 
+        self.record_update(update, synced)
         return updates_made
 
+    def record_properties_update(self, update, synced):
+        if synced:
+            self.all_tasks[update.identifier].update(update.properties)
+            self.changed_cards.append(update.identifier)
+
+    def subtasks_to_add(self, update, existing_subtask_names):
+        """The update's subtasks the card doesn't have yet, or None (and the card failed) if its subtasks couldn't
+        be listed."""
+        if existing_subtask_names is None:
+            self.log.error(u"Couldn't list sub-tasks of {0}, {1}".format(update.identifier, update.name))
+            self.failed_cards.append(update.identifier)
+            return None
+        self.log.debug(u"Existing sub-tasks in {0}, {1}: {2}".format(update.identifier, update.name,
+                                                                     existing_subtask_names))
+        subtasks = [subtask for subtask in update.subtasks if subtask.name not in existing_subtask_names]
+        for subtask in subtasks:
+            self.log.debug(u"Adding new subtask '{0}' to '{1}'".format(subtask.name, update.name))
+        return subtasks
+
+    def record_update(self, update, synced):
+        # runs on worker threads, so the fingerprint is queued here and written to the store by commit_fingerprints
+        if not synced:
+            self.failed_cards.append(update.identifier)
+        elif update.fingerprint is not None:
+            self.synced_fingerprints.append((update.identifier, update.fingerprint))
+
+    def get_stored_fingerprint(self, identifier):
+        if self.id_store is None:
+            return None
+        entry = self.id_store.get(identifier)
+        return entry["fingerprint"] if entry is not None else None
+
+    def commit_fingerprints(self):
+        """Write what worker threads queued for the ID store: synced fingerprints and, with an event queue, the new
+        state of updated cards."""
+        synced, self.synced_fingerprints = self.synced_fingerprints, []
+        changed, self.changed_cards = self.changed_cards, []
+        if self.id_store is None or not (synced or changed):
+            return
+        for identifier, fingerprint in synced:
+            self.id_store.set_fingerprint(identifier, fingerprint)
+        for identifier in changed:
+            task = self.all_tasks[identifier]
+            self.store_card_details(task, identifier, task.get("columnId"))
+        self.id_store.commit()
+
+    def take_failed_cards(self):
+        """The external IDs of the cards whose create or update failed since the last call."""
+        failed, self.failed_cards = self.failed_cards, []
+        return failed
+
     def get_column_name(self, _id):
-        columns = self.board_details["columns"]
-        column = next(item for item in columns if item["uniqueId"] == _id)
-        return column
+        return self.columns[_id]
 
-    def clear_board(self):
-        response = requests.get(TASKS_URI, headers=self.auth)
+    def get_swimlane(self, _id):
+        return self.swimlanes[_id]
 
-        for column in response:
-            tasks = column["tasks"]
-            for task in tasks:
-                _id = task["_id"]
-                requests.delete(TASKS_URI + "{0}".format(_id), headers=self.auth)
+    def clear_board(self):
+        uris = [self.tasks_uri + "{0}".format(task["_id"]) for _, task in self.iter_board_tasks()]
+        self.map(self.delete, uris)
 
     def get_subtasks(self, task_id):
         names = []
-        sub_tasks = self.request(TASKS_URI + "{0}/subtasks".format(task_id))
+        sub_tasks = self.request(self.tasks_uri + "{0}/subtasks".format(task_id))
+        if sub_tasks is None:
+            return None
         for sub_task in sub_tasks:
             names.append(sub_task['name'])
         return names
 
+    def map(self, func, items):
+        """Run independent calls on a bounded worker pool, returning results in the same order as items."""
+        items = list(items)
+        if len(items) < 2 or self.max_workers < 2:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
+
     def request(self, url, body=None):
+        method = "POST" if body else "GET"
+        start = time.perf_counter()
         try:
             if body:
-                # self.log.debug("POST {0}".format(url))
-                headers = self.auth.copy()
-                headers['Accept-Encoding'] = "gzip"
-                response = requests.post(url, headers=headers, json=body)
+                response = self.session.post(url, json=body, timeout=self.request_timeout)
             else:
-                # self.log.debug("GET {0}".format(url))
-                response = requests.get(url, headers=self.auth)
+                response = self.session.get(url, timeout=self.request_timeout)
 
-            self.api_requests += 1
-            self.bytes_transferred += len(response.content)
+            self.count_response(method, url, response, start)
 
             code = response.status_code
-            # self.log.debug("RESPONSE {0}".format(code))
 
             if code == 200:
                 json = response.json()
@@ -233,10 +740,123 @@ class KanbanFlowBoard:
                 requests.exceptions.Timeout,
                 requests.exceptions.ConnectTimeout,
         ) as e:
-            print(e)
+            self.count_response(method, url, None, start)
+            self.log.error(u"Request to {0} failed: {1}".format(url, e))
 
         return None
 
+    def delete(self, url):
+        start = time.perf_counter()
+        try:
+            response = self.session.delete(url, timeout=self.request_timeout)
+            self.count_response("DELETE", url, response, start)
+            return response.status_code == 200
+        except (
+                requests.ConnectionError,
+                requests.exceptions.ReadTimeout,
+                requests.exceptions.Timeout,
+                requests.exceptions.ConnectTimeout,
+        ) as e:
+            self.count_response("DELETE", url, None, start)
+            self.log.error(u"Delete of {0} failed: {1}".format(url, e))
+
+        return False
+
+    def count_response(self, method, url, response, start):
+        """Record a request in the metrics; a response of None means it failed without one."""
+        status = response.status_code if response is not None else "error"
+        size = len(response.content) if response is not None else 0
+        self.metrics.record_request(method, url[len(self.api_uri):], status, time.perf_counter() - start, size)
+
+
+def request_timeout_parts(timeout):
+    """(connect, read) seconds from the request_timeout setting: one number for both, or a [connect, read] pair."""
+    if isinstance(timeout, (list, tuple)):
+        connect, read = timeout
+        return connect, read
+    return timeout, timeout
+
+
+def task_fingerprint(name, note, subtasks):
+    """Stable hash of what an Omnifocus task puts on its card: name, note and subtask names and completion.
+
+    subtasks must already be in name order; plan_task sorts them once for the fingerprint and the card alike.
+    """
+    parts = [name, note or u'']
+    for subtask in subtasks or []:
+        parts.append(u"{0}:{1}".format(subtask.name, bool(subtask.completed)))
+    return hashlib.sha1(u"\0".join(parts).encode('utf-8')).hexdigest()
+
+
+def find_id_comment(comments):
+    """The external_id comment among a card's comments, or None."""
+    return next((item for item in comments if COMMENT_PREFIX in item["text"]), None)
+
+
+def check_comments_read(task_ids):
+    """Fail if some cards' comments couldn't be read: without their external IDs the sync would create their cards
+    again. The lookups that worked are kept, so the next run only repeats these."""
+    if task_ids:
+        raise IOError("Couldn't read the comments of {0} card(s): {1}".format(len(task_ids), ", ".join(task_ids)))
+
+
+def description_external_id(task):
+    """The external ID in a card's description marker, or None."""
+    match = ID_MARKER_PATTERN.search(task.get("description") or u"")
+    return match.group(1) if match else None
+
+
+def strip_id_marker(description):
+    return ID_MARKER_PATTERN.sub(u"", description or u"")
+
+
+def with_id_marker(description, identifier):
+    """description with identifier's marker on a line of its own at the end, replacing any marker it had."""
+    description = strip_id_marker(description)
+    marker = ID_MARKER.format(identifier)
+    return u"{0}\n\n{1}".format(description, marker) if description else marker
+
+
+def create_body(create):
+    """POST /tasks body for a CardCreate: its properties plus its subtasks, which keep their name order."""
+    body = dict(create.properties)
+    if create.subtasks:
+        body["subTasks"] = [subtask_body(subtask) for subtask in create.subtasks]
+    return body
+
+
+def subtask_body(subtask):
+    return {"name": subtask.name, "finished": bool(subtask.completed)}
+
+
+def task_page_query(column_id, start_task_id=None, swimlane_id=None):
+    params = [("columnId", column_id)]
+    if swimlane_id is not None:
+        params.append(("swimlaneId", swimlane_id))
+    params.append(("limit", TASKS_PAGE_SIZE))
+    if start_task_id is not None:
+        params.append(("startTaskId", start_task_id))
+    return urlencode(params)
+
+
+def column_pages(response, column_id):
+    """GET /tasks?columnId= answers with a list holding an entry per swimlane of the column, or just the one named
+    by swimlaneId; a response of None means the page couldn't be read."""
+    if response is None:
+        raise IOError("Couldn't load the tasks in column {0}".format(column_id))
+    if isinstance(response, list):
+        return response
+    return [response]
+
+
+def next_task_id(entries):
+    """The startTaskId of a lane's next page, or None once it's all read."""
+    next_ids = [entry["nextTaskId"] for entry in entries if entry.get("tasksLimited") and entry.get("nextTaskId")]
+    if len(next_ids) > 1:
+        # paging one of them would read the others' first pages again
+        raise IOError("Expected one swimlane per page of tasks, got {0} with more to read".format(len(next_ids)))
+    return next_ids[0] if next_ids else None
+
 
 def compare_description(description, note):
     result = False
@@ -0,0 +1,75 @@
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from kanban_board import KanbanFlow, board_tasks
+from omnifocus import Omnifocus
+from sync_metrics import SyncMetrics
+from sync_plan import plan_sync, SyncExecutor, DEFAULT_BATCH_SIZE
+
+
+class BoardResult(namedtuple('BoardResult', 'name cards_added tasks_closed repeating_tasks_closed plan metrics '
+                                           'error failed_cards')):
+    """What a sync did to one board; error is set (and the rest empty) if the board's sync failed. failed_cards are
+    the external IDs of the cards whose create or update failed."""
+    __slots__ = ()
+
+    def describe(self):
+        if self.error is not None:
+            return u"{0}: failed: {1}".format(self.name, self.error)
+        return u"{0}: {1} update(s), {2} task(s) closed & {3} repeating tasks closed in {4}s".format(
+            self.name, self.cards_added, len(self.tasks_closed), len(self.repeating_tasks_closed),
+            round(self.metrics.to_dict()["duration_seconds"], 2))
+
+
+class MultiBoardSync:
+    """Syncs one Omnifocus snapshot to several KanbanFlow boards, each on its own worker thread.
+
+    Every worker opens its own board, ID store and Omnifocus connection, since SQLite connections can't be shared
+    between threads, and records its own metrics. A board that fails is reported and doesn't stop the others.
+    """
+    log = logging.getLogger(__name__)
+
+    def __init__(self, configs, of_location=None, refresh_board=False, close_only=False, dry_run=False):
+        self.configs = configs
+        self.of_location = of_location
+        self.refresh_board = refresh_board
+        self.close_only = close_only
+        self.dry_run = dry_run
+
+    def run(self, tasks):
+        """Sync tasks to every board, returning a BoardResult per board in config order."""
+        with ThreadPoolExecutor(max_workers=len(self.configs)) as executor:
+            futures = [executor.submit(self.sync_board, config, tasks) for config in self.configs]
+            return [future.result() for future in futures]
+
+    def sync_board(self, config, tasks):
+        """Sync the tasks meant for one board; runs on a worker thread."""
+        name = config['name']
+        metrics = SyncMetrics(labels={'board': name})
+        board = None
+        omnifocus = None
+        try:
+            tasks = board_tasks(config, tasks)
+            board = KanbanFlow(metrics=metrics, refresh_board=self.refresh_board, close_only=self.close_only,
+                               config=config)
+            # only looks up the handful of close candidates, so a live read-only connection beats a snapshot each
+            omnifocus = Omnifocus(of_location=self.of_location)
+            with metrics.phase("plan"):
+                plan = plan_sync(board.kb, omnifocus, board.find_completed_card_ids(), tasks)
+            if self.dry_run:
+                return BoardResult(name, 0, [], [], plan, metrics, None, [])
+
+            executor = SyncExecutor(board.kb, omnifocus, config.get('batch_size', DEFAULT_BATCH_SIZE))
+            cards_added, tasks_closed, repeating_tasks_closed = executor.execute(plan)
+            return BoardResult(name, cards_added, tasks_closed, repeating_tasks_closed, plan, metrics, None,
+                               board.kb.take_failed_cards())
+        except Exception as e:
+            # a bad token, lane or network failure on one board mustn't stop the others
+            self.log.exception(u"Sync of board {0} failed".format(name))
+            return BoardResult(name, 0, [], [], None, metrics, e, [])
+        finally:
+            if board is not None:
+                board.id_store.close()
+            if omnifocus is not None:
+                omnifocus.close()
@@ -1,11 +1,14 @@
 # Based heavily on this: https://github.com/msabramo/PyOmniFocus
 
-import applescript
+import json
 import logging
 import os
 import re
 import sqlite3
+from collections import namedtuple
 from datetime import datetime
+from urllib.parse import quote
+from applescript_executor import AppleScriptExecutor, CLOSED, ALREADY_COMPLETED
 
 
 # DB_LOCATION = "/Library/Group Containers/34YW5XSRB7.com.omnigroup.OmniFocus/com.omnigroup.OmniFocus3/" \
@@ -15,47 +18,16 @@ DB_LOCATION = "/Library/Group Containers/34YW5XSRB7.com.omnigroup.OmniFocus/com.
               "com.omnigroup.OmniFocusModel/OmniFocusDatabase.db"
 DB_PREFIX = ''
 URI_PREFIX = 'omnifocus:///task/'
-DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 ENCODING = 'utf-8'
 
-IS_TASK_COMPLETE = """
-        on task_completed(task_id)
-            tell application "OmniFocus"
-                try
-                    set theTask to task id task_id of default document
-                    return completed of theTask
-                end try
-            end tell
-        end run
-    """
-CLOSE_TASK = """
-        on close_task(task_id)
-            tell application "OmniFocus"
-                set completed_task to task id task_id of default document
-                set task_title to name of completed_task
-                mark complete completed_task
-            end tell
-        end run
-    """
-
 FLAGGED_TASKS_SQL = """
 SELECT Task.persistentIdentifier,
        Task.name,
        Task.plainTextNote,
-       Task.containingProjectInfo,
-       Task.blocked,
-       Task.blockedByFutureStartDate,
-       Task.flagged,
-       Task.effectiveFlagged,
        Task.dateCompleted,
-       Task.dateDue,
-       Task.dateToStart,
-       Task.effectiveDateToStart,
        Task.childrenCount,
-       Task.repetitionMethodString,
-       Task.containsNextTask,
-       ProjectInfo.status,
-       Context.name AS "tag"
+       Task.dateModified,
+       json_group_array(Context.name) AS "tags"
 FROM Task
 JOIN TaskToTag ON TaskToTag.task = Task.persistentIdentifier
 JOIN Context ON Context.persistentIdentifier = TaskToTag.tag
@@ -67,213 +39,349 @@ WHERE Task.flagged = 1
   AND ProjectInfo.status NOT IN ('done',
                                  'dropped',
                                  'inactive')
+  AND (Task.dateToStart IS NULL
+       OR substr(Task.dateToStart, 1, 23) <= :now)
+  AND (substr(Task.name, 1, 2) = 'WF'
+       OR (NOT (IFNULL(Task.childrenCount, 0) AND NOT IFNULL(Task.containsNextTask, 0))
+           AND NOT (IFNULL(Task.blocked, 0) AND NOT IFNULL(Task.childrenCount, 0))))
+GROUP BY Task.persistentIdentifier
 """
 
-CHILD_TASKS_SQL = """
-SELECT Task.persistentIdentifier,
+# only what OmnifocusTask.from_row reads, plus parent for grouping; the filters work on Task directly. A recursive
+# query can't GROUP BY, so each row's tags are aggregated by a subquery instead of joined in
+CHILD_TASK_COLUMNS = """
+       Task.persistentIdentifier,
        Task.name,
        Task.plainTextNote,
-       Task.containingProjectInfo,
-       Task.blocked,
-       Task.blockedByFutureStartDate,
-       Task.flagged,
-       Task.effectiveFlagged,
        Task.dateCompleted,
-       Task.dateDue,
-       Task.dateToStart,
-       Task.effectiveDateToStart,
        Task.childrenCount,
-       Task.repetitionMethodString,
-       Task.containsNextTask,
-       ProjectInfo.status,
-       Context.name AS "tag"
-FROM Task
-JOIN TaskToTag ON TaskToTag.task = Task.persistentIdentifier
-JOIN Context ON Context.persistentIdentifier = TaskToTag.tag
-JOIN ProjectInfo ON ProjectInfo.task = Task.containingProjectInfo
-WHERE Task.dateCompleted IS NULL
+       Task.dateModified,
+       Task.parent,
+       (SELECT json_group_array(Context.name)
+        FROM TaskToTag
+        JOIN Context ON Context.persistentIdentifier = TaskToTag.tag
+        WHERE TaskToTag.task = Task.persistentIdentifier) AS "tags"
+"""
+
+# subtasks without a tag were never synced, as the tag join used to drop them
+CHILD_TASK_FILTER = """
+  AND EXISTS (SELECT 1 FROM TaskToTag WHERE TaskToTag.task = Task.persistentIdentifier)
+  AND Task.dateCompleted IS NULL
   AND Task.blockedByFutureStartDate IS 0
   AND ProjectInfo.status NOT IN ('done',
                                  'dropped',
                                  'inactive')
-  AND Task.parent = '{0}'
 """
 
+# Walks down from every parent in the bound JSON array at once. Only children that pass the filter and have
+# children of their own are expanded further, matching what a query per parent would have returned.
+CHILD_TASK_TREE_SQL = """
+WITH RECURSIVE child_task AS (
+    SELECT {columns}
+    FROM Task
+    JOIN ProjectInfo ON ProjectInfo.task = Task.containingProjectInfo
+    WHERE Task.parent IN (SELECT value FROM json_each(?)) {filter}
+    UNION
+    SELECT {columns}
+    FROM Task
+    JOIN child_task ON Task.parent = child_task.persistentIdentifier
+    JOIN ProjectInfo ON ProjectInfo.task = Task.containingProjectInfo
+    WHERE child_task.childrenCount {filter}
+)
+SELECT * FROM child_task
+""".format(columns=CHILD_TASK_COLUMNS, filter=CHILD_TASK_FILTER)
+
+
+# what closing needs to know about the tasks of completed cards, all of them in one query
+TASK_DETAILS_SQL = """
+SELECT persistentIdentifier,
+       name,
+       repetitionMethodString,
+       dateCompleted
+FROM Task
+WHERE persistentIdentifier IN (SELECT value FROM json_each(?))
+"""
 
-class Omnifocus:
-    log = logging.getLogger(__name__)
+# memory-map up to this much of the database so reads come from the page cache instead of read() calls
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
 
-    def __init__(self):
-        self.of_location = "{0}{1}".format(os.path.expanduser("~"), DB_LOCATION)
-        if not os.path.isfile(self.of_location):
-            self.of_location = re.sub(".OmniFocus3", ".OmniFocus3.MacAppStore", self.of_location)
-        self.log.debug("Using Omnifocus location {0}".format(self.of_location))
+# flagged rows read per round trip; each batch's subtasks are loaded with one query before its tasks are yielded
+FLAGGED_TASK_BATCH_SIZE = 500
 
-        self.conn = sqlite3.connect(self.of_location)
-        self.conn.row_factory = sqlite3.Row
 
-    def flagged_tasks(self):
-        self.log.debug("Looking for flagged tasks")
+TaskDetails = namedtuple('TaskDetails', 'name rep_rule completed_date')
 
-        tasks = dict()
 
-        cursor = self.conn.cursor()
-        cursor.execute(FLAGGED_TASKS_SQL)
-        results = cursor.fetchall()
-        self.log.debug("Found {0} results".format(len(results)))
-        cursor.close()
+class OmnifocusTask:
+    """A flagged Omnifocus task or one of its subtasks.
 
-        for row in results:
-            task = Omnifocus.task_from_row(row)
-            child_count = task['child_count']
-            name = task['name']
-            held = task['is_wf_task']
-            _id = task['identifier']
-            start_date = task['start_date']  # timestamp in OmniFocus 3.6
+    Slotted, with uri and completed worked out when asked for, since a big database means tens of thousands of these
+    at once. children is None for a task without subtasks. tags holds all of the task's tag names, sorted; type is
+    the one that decides its card type.
+    """
+    __slots__ = ('identifier', 'name', 'type', 'note', 'completed_date', 'modified', 'child_count', 'children',
+                 'tags')
+
+    def __init__(self, identifier, name, _type=None, note=None, completed_date=None, modified=None, child_count=0,
+                 children=None, tags=None):
+        self.identifier = identifier
+        self.name = name
+        self.type = _type
+        self.note = note
+        self.completed_date = completed_date
+        self.modified = modified
+        self.child_count = child_count
+        self.children = children
+        self.tags = tags or ()
+
+    @classmethod
+    def from_row(cls, row, type_index=None):
+        tags = tuple(sorted(json.loads(row['tags'])))
+        return cls(row['persistentIdentifier'], row['name'], card_type(tags, type_index), row['plainTextNote'],
+                   row['dateCompleted'], row['dateModified'], row['childrenCount'], tags=tags)
+
+    def with_type(self, _type):
+        """A copy of the task with another card type, sharing its subtasks; tasks are shared between boards."""
+        return OmnifocusTask(self.identifier, self.name, _type, self.note, self.completed_date, self.modified,
+                             self.child_count, self.children, self.tags)
+
+    @property
+    def uri(self):
+        return URI_PREFIX + self.identifier
+
+    @property
+    def completed(self):
+        return True if self.completed_date else None
+
+    def __repr__(self):
+        return "OmnifocusTask({0!r}, {1!r})".format(self.identifier, self.name)
 
-            if self.is_deferred(start_date):
-                self.log.debug(u"Ignoring deferred task '{0}'".format(name))
-                continue
-            if (child_count and not task['has_next_task']) and (child_count and not held):
-                self.log.debug(u"Ignoring task '{0}' with {1} sub-tasks but doesn't have next task".format(name,
-                                                                                                           child_count))
-                continue
-            if task['blocked'] and not child_count and not held:
-                self.log.debug(u"Ignoring blocked task '{0}' ({1} sub-tasks) that isn't a WF task".format(name,
-                                                                                                          child_count))
-                continue
 
-            tasks[_id] = self.init_task(task)
+class Omnifocus:
+    """Reads tasks from the Omnifocus database and closes them through AppleScript.
+
+    The database is only ever opened read-only, so it never takes a write lock the running app could wait on. With
+    snapshot, it is copied into memory with the SQLite backup API when opened and on every refresh(), and all queries
+    run against that point-in-time copy instead of the live file.
+
+    With card_types (the config's mapping), each flagged task's type is its highest priority tag among them and tasks
+    with none of those tags are skipped; without, it is the task's first tag by name.
+    """
+    log = logging.getLogger(__name__)
 
+    def __init__(self, executor=None, of_location=None, snapshot=False, mmap_size=DEFAULT_MMAP_SIZE, card_types=None):
+        self.executor = executor if executor is not None else AppleScriptExecutor()
+        self.of_location = of_location
+        if self.of_location is None:
+            self.of_location = "{0}{1}".format(os.path.expanduser("~"), DB_LOCATION)
+            if not os.path.isfile(self.of_location):
+                self.of_location = re.sub(".OmniFocus3", ".OmniFocus3.MacAppStore", self.of_location)
+        self.log.debug("Using Omnifocus location {0}".format(self.of_location))
+
+        self.snapshot = snapshot
+        self.mmap_size = mmap_size
+        self.type_index = card_type_index(card_types) if card_types is not None else None
+        self.conn = None
+        self.refresh()
+
+    def refresh(self):
+        """Take a new snapshot of the database; a live connection already sees every committed change."""
+        if self.conn is not None and not self.snapshot:
+            return
+
+        source = connect_read_only(self.of_location, self.mmap_size)
+        if self.snapshot:
+            conn = sqlite3.connect(":memory:")
+            # one step, so the copy is consistent: the app can keep writing to its WAL but the backup reads one
+            # version of the database throughout
+            source.backup(conn)
+            source.close()
+            self.log.debug("Took an in-memory snapshot of {0}".format(self.of_location))
+        else:
+            conn = source
+
+        conn.row_factory = sqlite3.Row
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = conn
+
+    def close(self):
+        self.conn.close()
+
+    def flagged_tasks(self):
+        tasks = dict((task.identifier, task) for task in self.iter_flagged_tasks())
         self.log.debug("Found {0} flagged tasks".format(len(tasks)))
         return tasks
 
-    @staticmethod
-    def task_from_row(row):
-        name = row['name']
-        blocked = row['blocked']
-        child_count = row['childrenCount']
-        has_next_task = row['containsNextTask']
-        identifier = row['persistentIdentifier']
-        tag = row['tag']
-        note = row['plainTextNote']
-        completed_date = row['dateCompleted']
-        is_wf_task = name.startswith('WF')
-        start_date = row['dateToStart']
-
-        return dict(name=name, blocked=blocked, child_count=child_count, has_next_task=has_next_task,
-                    start_date=start_date, identifier=identifier, tag=tag, note=note,
-                    completed_date=completed_date, is_wf_task=is_wf_task)
-
-    def close_tasks(self, identifiers):
+    def iter_flagged_tasks(self, batch_size=FLAGGED_TASK_BATCH_SIZE):
+        """Yield each flagged OmnifocusTask with its subtasks, reading the cursor a batch at a time."""
+        self.log.debug("Looking for flagged tasks")
+        untyped = 0
+
+        cursor = self.conn.cursor()
+        # deferred, blocked and parent-without-next-task rows are filtered out by the query; WF tasks are held
+        # tasks and are synced even when blocked
+        cursor.execute(FLAGGED_TASKS_SQL, {'now': Omnifocus.sql_now()})
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                # one row per task, its tags aggregated; those no card type applies to are dropped before their
+                # subtasks are loaded
+                batch = []
+                for row in rows:
+                    task = OmnifocusTask.from_row(row, self.type_index)
+                    if task.type is None:
+                        untyped += 1
+                        self.log.debug(u"Skipping {0} ({1}), none of its tags ({2}) is a card type".format(
+                            task.uri, task.name, ", ".join(task.tags)))
+                    else:
+                        batch.append(task)
+
+                children = self.child_tasks([task.identifier for task in batch if task.child_count])
+                for task in batch:
+                    yield self.init_task(task, children)
+        finally:
+            cursor.close()
+        if untyped:
+            self.log.debug("Skipped {0} flagged task(s) without a card type".format(untyped))
+
+    def close_tasks(self, identifiers, details=None):
+        """Close the tasks of completed cards, given as {"id", "name"} dicts, returning those closed and those closed
+        that repeat.
+
+        The tasks are looked up in one query first, unless their task_details are passed in, and any that are gone,
+        renamed or already completed are skipped there, so only the ones that really need closing reach AppleScript.
+        """
         tasks_closed = []
         repeating_tasks_closed = []
+        to_close = []
+
+        if details is None:
+            details = self.task_details([identifier["id"] for identifier in identifiers])
         for identifier in identifiers:
             _id = identifier["id"]
             name = identifier["name"]
+            task = details.get(_id)
 
-            close_task_result = self.close_task(_id, name)
-
-            if close_task_result == 1:
-                tasks_closed.append(identifier)
-            elif close_task_result == 2:
-                repeating_tasks_closed.append(identifier)
-
-        return tasks_closed, repeating_tasks_closed
+            if task is None:
+                self.log.debug(u"Ignoring {0}{1} ({2}), not found in Omnifocus".format(URI_PREFIX, _id, name))
+                continue
 
-    def close_task(self, _id, name):
-        try:
-            of_task_name, rep_rule = self.get_task_details(_id)
-            already_closed = Omnifocus.task_completed(_id)
+            if name != task.name:
+                self.log.debug(
+                    u"Ignoring {0}{1} ({2}), names don't match ({3})".format(URI_PREFIX, _id, name, task.name))
+                continue
 
-            if already_closed:
+            if task.completed_date is not None:
                 self.log.debug(u"Ignoring {0}{1} ({2}), already completed in Omnifocus".format(URI_PREFIX, _id, name))
-                return 0
+                continue
 
-            if name != of_task_name:
-                self.log.debug(
-                    u"Ignoring {0}{1} ({2}), names don't match ({3})".format(URI_PREFIX, _id, name, of_task_name))
-                return 0
+            to_close.append((identifier, task.rep_rule))
+
+        results = self.executor.close_tasks([identifier["id"] for identifier, _ in to_close])
 
-            rep_type = 1
+        for identifier, rep_rule in to_close:
+            _id = identifier["id"]
+            name = identifier["name"]
+            result = results.get(_id)
 
-            if rep_rule is None:
-                self.log.debug(u"Closing {0}{1} ({2})".format(URI_PREFIX, _id, name))
+            # completed since the database was read
+            if result == ALREADY_COMPLETED:
+                self.log.debug(u"Ignoring {0}{1} ({2}), already completed in Omnifocus".format(URI_PREFIX, _id, name))
+            elif result != CLOSED:
+                self.log.debug(u"Ignoring {0}{1} ({2}), not found in Omnifocus".format(URI_PREFIX, _id, name))
+            elif rep_rule is None:
+                self.log.debug(u"Closed {0}{1} ({2})".format(URI_PREFIX, _id, name))
+                tasks_closed.append(identifier)
             else:
-                self.log.debug(u"Closing repeating task {0}{1} ({2})".format(URI_PREFIX, _id, name))
-                rep_type = 2
+                self.log.debug(u"Closed repeating task {0}{1} ({2})".format(URI_PREFIX, _id, name))
+                repeating_tasks_closed.append(identifier)
 
-            scpt = applescript.AppleScript(CLOSE_TASK)
-            scpt.call('close_task', _id)
+        return tasks_closed, repeating_tasks_closed
 
-            return rep_type
-        except ValueError as e:
-            self.log.debug(u"Ignoring {0}{1} ({2}), not found in Omnifocus".format(URI_PREFIX, _id, name))
-            self.log.debug(e)
-            return 0
+    def close_task(self, _id, name):
+        tasks_closed, repeating_tasks_closed = self.close_tasks([{"id": _id, "name": name}])
+        if tasks_closed:
+            return 1
+        if repeating_tasks_closed:
+            return 2
+        return 0
 
     def get_task_details(self, _id):
-        query = "SELECT * FROM Task WHERE persistentIdentifier = '{0}'".format(_id)
-        cursor = self.conn.cursor()
-        cursor.execute(query)
-        result = cursor.fetchone()
-
-        if result is None:
+        task = self.task_details([_id]).get(_id)
+        if task is None:
             raise ValueError("{0} not found in Omnifocus".format(_id))
+        return task.name, task.rep_rule
 
-        name = result["name"]
-        rep_rule = result["repetitionMethodString"]
-        return name, rep_rule
-
-    def init_task(self, task):
-        completed = None
-
-        if task['completed_date']:
-            completed = True
+    def task_details(self, identifiers):
+        """TaskDetails by ID for those of identifiers that exist, read with one query however many there are."""
+        if not identifiers:
+            return dict()
 
-        _id = task['identifier']
-        child_count = task['child_count']
-
-        task_dict = dict(identifier=_id, name=task['name'], type=task['tag'], note=task['note'], completed=completed,
-                         uri="{0}{1}".format(URI_PREFIX, _id))
-
-        if child_count:
-            child_tasks = []
-            cursor = self.conn.cursor()
-            cursor.execute(CHILD_TASKS_SQL.format(_id))
-            results = cursor.fetchall()
-            print("Found {0} child tasks".format(len(results)))
-            cursor.close()
-            for child in results:
-                child_tasks.append(self.init_task(Omnifocus.task_from_row(child)))
+        cursor = self.conn.cursor()
+        cursor.execute(TASK_DETAILS_SQL, (json.dumps(list(identifiers)),))
+        details = dict((row['persistentIdentifier'],
+                        TaskDetails(row['name'], row['repetitionMethodString'], row['dateCompleted']))
+                       for row in cursor)
+        cursor.close()
+        return details
 
-            task_dict['children'] = child_tasks
+    def child_tasks(self, parent_ids):
+        """Load the whole subtask forest under parent_ids in one query, grouped by parent ID in row order."""
+        children = dict()
+        if not parent_ids:
+            return children
 
-        logging.debug("Created task {0}".format(task_dict))
-        return task_dict
+        cursor = self.conn.cursor()
+        cursor.execute(CHILD_TASK_TREE_SQL, (json.dumps(parent_ids),))
+        for row in cursor:
+            children.setdefault(row['parent'], []).append(OmnifocusTask.from_row(row, self.type_index))
+        cursor.close()
 
-    @staticmethod
-    def task_completed(identifier):
-        return applescript.AppleScript(IS_TASK_COMPLETE).call('task_completed', identifier)
+        self.log.debug("Found {0} child tasks under {1} parents".format(
+            sum(len(rows) for rows in children.values()), len(parent_ids)))
+        return children
 
-    @staticmethod
-    def deferred_date(date_to_start):
-        date = None
-        if date_to_start is not None:
-            if date_to_start[-1:] != "Z":
-                date_to_start = date_to_start + "Z"
-            logging.debug("Determining task's deferred date: {0}".format(date_to_start))
-            date = datetime.strptime(date_to_start, DATETIME_FORMAT)
-        return date
+    def init_task(self, task, children):
+        """Attach task's subtasks, and theirs, from the rows child_tasks grouped by parent ID."""
+        if task.child_count:
+            task.children = [self.init_task(child, children) for child in children.get(task.identifier, [])]
+        return task
 
     @staticmethod
-    def is_deferred(date_to_start):
-        now = datetime.now()
-        logging.debug("Checking if task is deferred based on date_to_start {0} > {1}".format(date_to_start, now))
-        deferred = False
-        if date_to_start is not None and Omnifocus.deferred_date(date_to_start) > now:
-            deferred = True
-        return deferred
+    def sql_now():
+        """The current local time in the format OmniFocus stores dateToStart, to millisecond precision."""
+        return datetime.now().isoformat(timespec='milliseconds')
+
+
+def card_type_index(card_types, tags=None):
+    """Map each tag that is a card type to its priority, 0 being the highest: the order card_types lists them in.
+    With tags, only those tags are indexed."""
+    if tags is not None:
+        tags = set(tags)
+    return dict((tag, priority) for priority, tag in enumerate(tag for tag in card_types
+                                                                if tags is None or tag in tags))
+
+
+def card_type(tags, type_index=None):
+    """The card type for a task with tags: its highest priority tag in type_index, None if it has none of them, or
+    without an index its first tag."""
+    if type_index is None:
+        return tags[0] if tags else None
+    typed = [tag for tag in tags if tag in type_index]
+    return min(typed, key=type_index.get) if typed else None
+
+
+def connect_read_only(path, mmap_size=DEFAULT_MMAP_SIZE):
+    """Open the database at path through a read-only URI, refusing writes on the connection as well."""
+    # autocommit, so the sqlite3 module never leaves a transaction (and its lock) open between reads
+    conn = sqlite3.connect("file:{0}?mode=ro".format(quote(os.path.abspath(path))), uri=True, isolation_level=None)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute("PRAGMA mmap_size = {0:d}".format(mmap_size))
+    return conn
 
 
 if __name__ == '__main__':
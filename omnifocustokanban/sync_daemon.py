@@ -0,0 +1,149 @@
+import logging
+import os
+import time
+
+from change_tracker import database_state
+from sync_plan import plan_sync, SyncExecutor, DEFAULT_BATCH_SIZE
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_BOARD_REFRESH_INTERVAL = 300.0
+
+
+class DatabaseWatcher:
+    """Waits for writes to the Omnifocus database or its WAL file.
+
+    Uses inotify when inotify_simple is installed and falls back to polling the files' mtime and size.
+    """
+    log = logging.getLogger(__name__)
+
+    def __init__(self, db_path, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.names = {os.path.basename(db_path), os.path.basename(db_path) + "-wal"}
+        self.state = database_state(db_path)
+        self.inotify = None
+
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                self.inotify.add_watch(os.path.dirname(db_path) or ".",
+                                       flags.MODIFY | flags.CREATE | flags.MOVED_TO | flags.CLOSE_WRITE)
+            except OSError as e:
+                self.log.warning("Can't watch {0} with inotify, polling instead: {1}".format(db_path, e))
+                self.inotify = None
+
+        self.log.debug("Watching {0} ({1})".format(db_path, "inotify" if self.inotify else "polling"))
+
+    def wait_for_change(self, timeout):
+        """Block for up to timeout seconds, returning True as soon as the database changes."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if self.inotify is not None:
+                events = self.inotify.read(timeout=int(remaining * 1000))
+                changed = any(event.name in self.names for event in events)
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+                changed = False
+
+            # inotify only wakes us up, the file state decides whether anything actually changed
+            state = database_state(self.db_path)
+            if changed or state != self.state:
+                self.state = state
+                return True
+
+    def wait_until_quiet(self, debounce):
+        """Let a burst of writes (Omnifocus saves in several steps) settle before syncing."""
+        while self.wait_for_change(debounce):
+            pass
+
+
+class SyncDaemon:
+    """Keeps the board snapshot and Omnifocus connection in memory and runs an incremental sync whenever the
+    Omnifocus database changes, reloading the board every refresh_interval seconds."""
+    log = logging.getLogger(__name__)
+
+    def __init__(self, board, omnifocus, tracker, debounce=DEFAULT_DEBOUNCE,
+                 refresh_interval=DEFAULT_BOARD_REFRESH_INTERVAL, poll_interval=DEFAULT_POLL_INTERVAL,
+                 batch_size=DEFAULT_BATCH_SIZE, metrics_textfile=None):
+        self.board = board
+        self.omnifocus = omnifocus
+        self.tracker = tracker
+        self.debounce = debounce
+        self.refresh_interval = refresh_interval
+        self.metrics_textfile = metrics_textfile
+        self.executor = SyncExecutor(board, omnifocus, batch_size)
+        self.watcher = DatabaseWatcher(omnifocus.of_location, poll_interval)
+        self.running = False
+
+    def run(self):
+        self.running = True
+        last_refresh = time.monotonic()
+        self.sync(full=True)
+
+        while self.running:
+            timeout = max(self.refresh_interval - (time.monotonic() - last_refresh), 0)
+            if self.watcher.wait_for_change(timeout):
+                self.watcher.wait_until_quiet(self.debounce)
+                self.sync()
+
+            if time.monotonic() - last_refresh >= self.refresh_interval:
+                self.log.debug("Refreshing board state")
+                try:
+                    self.board.refresh()
+                except Exception:
+                    # the daemon outlives any one failure; the next refresh tries again
+                    self.log.exception("Board refresh failed")
+                last_refresh = time.monotonic()
+                self.sync(full=True)
+
+    def stop(self):
+        self.running = False
+
+    def sync(self, full=False):
+        """Sync changed tasks, or every flagged task with full (cards whose fingerprint matches still cost
+        nothing) so cards deleted or edited on the board get reconciled."""
+        start = time.monotonic()
+        metrics = self.board.metrics
+        try:
+            with metrics.phase("omnifocus_read"):
+                self.omnifocus.refresh()
+                changed, removed = self.tracker.changed_tasks(self.omnifocus, full)
+            with metrics.phase("plan"):
+                plan = plan_sync(self.board, self.omnifocus, self.board.completed_tasks, changed)
+            if not plan.items():
+                self.tracker.commit()
+                return None
+
+            cards_added, tasks_closed, repeating_tasks_closed = self.executor.execute(plan)
+            self.tracker.commit(self.board.take_failed_cards())
+            # every card in a completed lane has now had its close attempted; the next refresh finds new ones
+            self.board.completed_tasks = []
+        # e.g. "database is locked" while OmniFocus checkpoints its WAL, an AppleScript error or a dropped connection;
+        # the next change tries again
+        except Exception:
+            self.log.exception("Sync failed")
+            return None
+
+        result = "{0} update(s), {1} task(s) closed & {2} repeating tasks closed in {3}s".format(
+            cards_added, len(tasks_closed), len(repeating_tasks_closed), round(time.monotonic() - start, 2))
+        self.log.info(result)
+        self.write_metrics()
+        return result
+
+    def write_metrics(self):
+        if self.metrics_textfile is None:
+            return
+        try:
+            self.board.metrics.write_prometheus(self.metrics_textfile)
+        except OSError as e:
+            self.log.error("Couldn't write metrics to {0}: {1}".format(self.metrics_textfile, e))
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# request latency histogram upper bounds in seconds, the last bucket catches everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+METRIC_PREFIX = "of_to_kb"
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.statuses = {}
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def record(self, status, seconds, size):
+        self.requests += 1
+        self.bytes += size
+        self.seconds += seconds
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+    def to_dict(self):
+        return {"requests": self.requests, "bytes": self.bytes, "seconds": round(self.seconds, 4),
+                "statuses": dict((str(status), count) for status, count in sorted(self.statuses.items(), key=str)),
+                "latency_buckets": dict((format_bound(bound), count)
+                                        for bound, count in zip(LATENCY_BUCKETS, self.buckets))}
+
+
+class SyncMetrics:
+    """Per-phase durations and per-endpoint API request counts, latencies, status codes and bytes for a sync run.
+
+    One instance is shared by everything in a run (board, executor, of-to-kb) and is safe to update from the
+    board's worker threads. Phases and endpoints accumulate, so in --watch mode the numbers are totals since start.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.endpoints = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name, seconds):
+        with self.lock:
+            runs, total, _ = self.phases.get(name, (0, 0.0, 0.0))
+            self.phases[name] = (runs + 1, total + seconds, seconds)
+
+    def record_request(self, method, path, status, seconds, size=0):
+        """Count one API request; path is relative to the API root and status is the HTTP code or 'error'."""
+        key = (method, endpoint_name(path))
+        with self.lock:
+            endpoint = self.endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.endpoints[key] = EndpointMetrics()
+            endpoint.record(status, seconds, size)
+
+    @property
+    def api_requests(self):
+        with self.lock:
+            return sum(endpoint.requests for endpoint in self.endpoints.values())
+
+    @property
+    def bytes_transferred(self):
+        with self.lock:
+            return sum(endpoint.bytes for endpoint in self.endpoints.values())
+
+    def to_dict(self):
+        with self.lock:
+            phases = dict((name, {"runs": runs, "seconds": round(total, 4), "last_seconds": round(last, 4)})
+                          for name, (runs, total, last) in self.phases.items())
+            endpoints = [dict(endpoint.to_dict(), method=method, endpoint=name)
+                         for (method, name), endpoint in sorted(self.endpoints.items())]
+        return {"labels": dict(self.labels), "started": self.started,
+                "duration_seconds": round(time.time() - self.started, 4),
+                "api_requests": sum(endpoint["requests"] for endpoint in endpoints),
+                "bytes_transferred": sum(endpoint["bytes"] for endpoint in endpoints),
+                "phases": phases, "endpoints": endpoints}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        return render_prometheus([self])
+
+    def write_prometheus(self, path):
+        write_atomically(path, self.to_prometheus())
+
+
+def render_prometheus(all_metrics):
+    """Render metrics in the Prometheus text exposition format, for the node_exporter textfile collector. Each
+    SyncMetrics' labels (e.g. the board) are added to its samples so several can share one file."""
+    runs = [(sorted(metrics.labels.items()), metrics.to_dict()) for metrics in all_metrics]
+    lines = []
+
+    def metric(name, kind, description):
+        lines.append("# HELP {0}_{1} {2}".format(METRIC_PREFIX, name, description))
+        lines.append("# TYPE {0}_{1} {2}".format(METRIC_PREFIX, name, kind))
+
+    def sample(name, labels, value):
+        label_text = ",".join('{0}="{1}"'.format(key, escape_label(label)) for key, label in labels)
+        lines.append("{0}_{1}{{{2}}} {3}".format(METRIC_PREFIX, name, label_text, value) if label_text
+                     else "{0}_{1} {2}".format(METRIC_PREFIX, name, value))
+
+    metric("run_started_timestamp_seconds", "gauge", "Unix time the sync process started")
+    for labels, data in runs:
+        sample("run_started_timestamp_seconds", labels, data["started"])
+    metric("run_duration_seconds", "gauge", "Seconds since the sync process started")
+    for labels, data in runs:
+        sample("run_duration_seconds", labels, data["duration_seconds"])
+
+    for name, kind, key, description in (
+            ("phase_seconds_total", "counter", "seconds", "Time spent in each sync phase"),
+            ("phase_runs_total", "counter", "runs", "Number of times each sync phase ran"),
+            ("phase_last_seconds", "gauge", "last_seconds", "Duration of the most recent run of each sync phase")):
+        metric(name, kind, description)
+        for labels, data in runs:
+            for phase, values in sorted(data["phases"].items()):
+                sample(name, labels + [("phase", phase)], values[key])
+
+    metric("api_requests_total", "counter", "KanbanFlow API requests by endpoint, method and status")
+    for labels, data in runs:
+        for endpoint in data["endpoints"]:
+            for status, count in sorted(endpoint["statuses"].items()):
+                sample("api_requests_total", labels + [("endpoint", endpoint["endpoint"]),
+                                                       ("method", endpoint["method"]), ("status", status)], count)
+
+    metric("api_response_bytes_total", "counter", "KanbanFlow API response bytes by endpoint and method")
+    for labels, data in runs:
+        for endpoint in data["endpoints"]:
+            sample("api_response_bytes_total", labels + [("endpoint", endpoint["endpoint"]),
+                                                         ("method", endpoint["method"])], endpoint["bytes"])
+
+    metric("api_request_duration_seconds", "histogram", "KanbanFlow API request latency")
+    for labels, data in runs:
+        for endpoint in data["endpoints"]:
+            endpoint_labels = labels + [("endpoint", endpoint["endpoint"]), ("method", endpoint["method"])]
+            cumulative = 0
+            for bound, count in endpoint["latency_buckets"].items():
+                cumulative += count
+                sample("api_request_duration_seconds_bucket", endpoint_labels + [("le", bound)], cumulative)
+            sample("api_request_duration_seconds_sum", endpoint_labels, endpoint["seconds"])
+            sample("api_request_duration_seconds_count", endpoint_labels, endpoint["requests"])
+
+    return "\n".join(lines) + "\n"
+
+
+def render_json(all_metrics):
+    """One run's metrics as a JSON object, several (one per board) as a list."""
+    if len(all_metrics) == 1:
+        return all_metrics[0].to_json()
+    return json.dumps([metrics.to_dict() for metrics in all_metrics], indent=2, sort_keys=True)
+
+
+def endpoint_name(path):
+    """Collapse a request path to its endpoint, e.g. tasks/abc123/comments -> tasks/{id}/comments."""
+    segments = path.split("?", 1)[0].strip("/").split("/")
+    # KanbanFlow paths alternate collection and ID: tasks/<id>/comments/<id>
+    return "/".join("{id}" if index % 2 else segment for index, segment in enumerate(segments))
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def write_atomically(path, text):
+    """Write via a temporary file and rename so a collector never reads a half-written file."""
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except OSError:
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,180 @@
+import logging
+from collections import namedtuple
+
+DEFAULT_BATCH_SIZE = 50
+
+
+class CardCreate(namedtuple('CardCreate', 'identifier properties subtasks fingerprint')):
+    """A new card: one task POST, with the subtasks and the external ID in it."""
+    __slots__ = ()
+
+    def api_calls(self):
+        return 1
+
+    def describe(self):
+        return u"create '{0}' ({1}) with {2} subtask(s)".format(self.properties['name'], self.identifier,
+                                                                len(self.subtasks))
+
+
+class CardUpdate(namedtuple('CardUpdate', 'identifier task_id name properties subtasks existing_subtask_names '
+                                         'fingerprint')):
+    """Changes to an existing card. If existing_subtask_names is None the card's subtasks have to be fetched first
+    and subtasks is the upper bound of what might be added."""
+    __slots__ = ()
+
+    def api_calls(self):
+        calls = len(self.subtasks)
+        if self.properties:
+            calls += 1
+        if self.subtasks and self.existing_subtask_names is None:
+            calls += 1
+        return calls
+
+    def describe(self):
+        changes = sorted(self.properties.keys())
+        if self.subtasks:
+            bound = "up to " if self.existing_subtask_names is None else ""
+            changes.append("{0}{1} new subtask(s)".format(bound, len(self.subtasks)))
+        return u"update '{0}' ({1}): {2}".format(self.name, self.identifier, ", ".join(changes))
+
+
+class TaskClose(namedtuple('TaskClose', 'identifier name repeating')):
+    """An Omnifocus task whose card is in a completed lane. Closing it is an AppleScript call, not an API call."""
+    __slots__ = ()
+
+    def api_calls(self):
+        return 0
+
+    def describe(self):
+        kind = "repeating task" if self.repeating else "task"
+        return u"close {0} '{1}' ({2})".format(kind, self.name, self.identifier)
+
+
+class ExternalIdRemoval(namedtuple('ExternalIdRemoval', 'identifier task_id comment_id embedded')):
+    """Removal of the external ID from the card of a closed repeating task. A card with the ID in its description
+    needs that updated, plus a delete for any comment left from before; an older card needs its comment deleted,
+    after a lookup if the comment's ID isn't stored."""
+    __slots__ = ()
+
+    def api_calls(self):
+        if self.embedded:
+            return 1 if self.comment_id is None else 2
+        return 1 if self.comment_id is not None else 2
+
+    def describe(self):
+        return u"remove external ID from card {0} ({1})".format(self.task_id, self.identifier)
+
+
+class SyncPlan:
+    """Everything a sync would do, worked out from the Omnifocus and board snapshots before any API call."""
+
+    def __init__(self):
+        self.closes = []
+        self.id_removals = []
+        self.creates = []
+        self.updates = []
+        self.skipped = []
+        # the TaskDetails of the completed cards' tasks, so closing them doesn't read them again
+        self.task_details = {}
+
+    def add(self, item):
+        if isinstance(item, CardCreate):
+            self.creates.append(item)
+        elif isinstance(item, CardUpdate):
+            self.updates.append(item)
+        elif isinstance(item, TaskClose):
+            self.closes.append(item)
+        elif isinstance(item, ExternalIdRemoval):
+            self.id_removals.append(item)
+
+    def items(self):
+        return self.closes + self.id_removals + self.creates + self.updates
+
+    def api_calls(self):
+        return sum(item.api_calls() for item in self.items())
+
+    def summary(self):
+        lines = ["Plan: {0} card(s) to create, {1} to update, {2} task(s) to close, {3} external ID(s) to remove, "
+                 "{4} unchanged".format(len(self.creates), len(self.updates), len(self.closes),
+                                        len(self.id_removals), len(self.skipped)),
+                 "Predicted API calls: {0}".format(self.api_calls())]
+        lines.extend("  " + item.describe() for item in self.items())
+        return "\n".join(lines)
+
+
+def plan_sync(board, omnifocus, completed_cards, tasks):
+    """Diff the Omnifocus tasks and the cards in the board's completed lanes against the board snapshot."""
+    plan = SyncPlan()
+    closing = set()
+
+    # cards stay in the done lanes long after their task is closed, so those are dropped here, with one query
+    details = omnifocus.task_details([card["id"] for card in completed_cards])
+    plan.task_details = details
+    for card in completed_cards:
+        _id = card["id"]
+        name = card["name"]
+        task = details.get(_id)
+        if task is None or name != task.name or task.completed_date is not None:
+            plan.skipped.append(_id)
+            continue
+
+        closing.add(_id)
+        plan.add(TaskClose(_id, name, task.rep_rule is not None))
+        if task.rep_rule is not None:
+            task_id, comment_id = board.get_stored_ids(_id)
+            plan.add(ExternalIdRemoval(_id, task_id, comment_id, board.has_embedded_id(_id)))
+
+    for task in tasks:
+        identifier = task.identifier
+        if identifier in closing:
+            continue
+
+        item = board.plan_task(task)
+        if item is None:
+            plan.skipped.append(identifier)
+        else:
+            plan.add(item)
+
+    return plan
+
+
+class SyncExecutor:
+    """Runs a SyncPlan: Omnifocus closes first, then external ID removals, card creates and card updates in
+    batches."""
+    log = logging.getLogger(__name__)
+
+    def __init__(self, board, omnifocus, batch_size=DEFAULT_BATCH_SIZE):
+        self.board = board
+        self.omnifocus = omnifocus
+        self.batch_size = batch_size
+
+    def execute(self, plan):
+        metrics = self.board.metrics
+        to_close = [{"id": close.identifier, "name": close.name} for close in plan.closes]
+        with metrics.phase("close"):
+            tasks_closed, repeating_tasks_closed = self.omnifocus.close_tasks(to_close, plan.task_details)
+
+            # only cards whose repeating task was actually closed lose their external ID
+            closed_ids = set(task["id"] for task in repeating_tasks_closed)
+            for removal in plan.id_removals:
+                if removal.identifier in closed_ids:
+                    self.board.remove_external_id(removal.identifier)
+
+        updates_made = 0
+        # creates stay in plan order so cards land on the board in a predictable order
+        with metrics.phase("create"):
+            for batch in self.batches(plan.creates):
+                updates_made += self.board.execute_creates(batch)
+                self.log.debug("Created {0} card(s)".format(len(batch)))
+
+        with metrics.phase("update"):
+            for batch in self.batches(plan.updates):
+                updates_made += sum(self.board.map(self.board.execute_update, batch))
+                self.log.debug("Updated {0} card(s)".format(len(batch)))
+
+        self.board.commit_fingerprints()
+        return updates_made, tasks_closed, repeating_tasks_closed
+
+    def batches(self, items):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
@@ -0,0 +1,104 @@
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8731
+
+
+class WebhookReceiver:
+    """Local endpoint for KanbanFlow webhooks that appends every event to an EventQueue before answering.
+
+    KanbanFlow posts one JSON event per request (a list is accepted too, for replays). With a secret, requests must
+    carry it as ?secret=... in the callback URL, since KanbanFlow doesn't sign its requests. Anything that isn't
+    valid JSON gets a 400, so the sender knows the event wasn't stored.
+    """
+    log = logging.getLogger(__name__)
+
+    def __init__(self, queue, host=DEFAULT_HOST, port=DEFAULT_PORT, secret=None):
+        self.queue = queue
+        self.secret = secret
+        # handler threads share the queue's connection, one write at a time
+        self.queue_lock = threading.Lock()
+        self.events_received = 0
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{0}:{1}/".format(host, port)
+
+    def start(self):
+        """Serve on a background thread, e.g. next to a replayer in the same process."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def receive(self, events):
+        with self.queue_lock:
+            self.queue.put(events)
+            self.events_received += len(events)
+        self.log.debug("Queued {0} KanbanFlow event(s): {1}".format(
+            len(events), ", ".join(str(event.get("eventType")) for event in events)))
+
+    def authorised(self, query):
+        if not self.secret:
+            return True
+        supplied = parse_qs(query).get("secret", [""])[0]
+        return hmac.compare_digest(supplied.encode("utf-8"), self.secret.encode("utf-8"))
+
+    def handler_class(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                receiver.log.debug(format % args)
+
+            def do_GET(self):
+                # lets KanbanFlow (or a health check) see the endpoint is up
+                self.respond(200, {})
+
+            def do_POST(self):
+                _, _, query = self.path.partition("?")
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                if not receiver.authorised(query):
+                    self.respond(403, {"errorMessage": "Wrong secret"})
+                    return
+
+                try:
+                    payload = json.loads(body.decode("utf-8"))
+                except ValueError as e:
+                    self.respond(400, {"errorMessage": "Invalid JSON: {0}".format(e)})
+                    return
+                events = payload if isinstance(payload, list) else [payload]
+                if not all(isinstance(event, dict) for event in events):
+                    self.respond(400, {"errorMessage": "Expected a JSON object per event"})
+                    return
+
+                receiver.receive(events)
+                self.respond(200, {})
+
+            def respond(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# the modules import each other by name, like of-to-kb does; the fake server and generator live with the benchmarks
+sys.path[:0] = [os.path.join(ROOT, "omnifocustokanban"), os.path.join(ROOT, "benchmarks")]
+
+from fake_kanbanflow import FakeKanbanFlowServer
+from id_store import IdStore
+from kanban_flow_board import KanbanFlowBoard
+
+COLUMNS = [("todo", "To-do"), ("doing", "In progress"), ("done", "Done")]
+CARD_TYPES = {"work": {"color": "red"}, "home": {"color": "red"}}
+
+
+@pytest.fixture
+def server():
+    server = FakeKanbanFlowServer(COLUMNS).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def id_store(tmp_path):
+    store = IdStore(str(tmp_path / "kanbanflow-ids.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def make_board(server, id_store):
+    def make_board(**kwargs):
+        kwargs.setdefault("id_store", id_store)
+        return KanbanFlowBoard("test", "todo", CARD_TYPES, ["done"], api_uri=server.api_uri, **kwargs)
+    return make_board
+
+
+def add_card(state, name, column_id="todo", description="", comment=None, **properties):
+    """Put a card straight on the fake board, optionally with a comment, as if it was made by hand or by an older
+    version; returns its task ID."""
+    _id = state.next_id("task-")
+    state.tasks[_id] = dict(properties, _id=_id, name=name, columnId=column_id, description=description,
+                            swimlaneId=properties.get("swimlaneId", state.swimlane))
+    state.comments[_id] = []
+    state.subtasks[_id] = []
+    if comment is not None:
+        state.comments[_id].append({"_id": state.next_id("comment-"), "text": comment})
+    return _id
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from async_kanban_flow_board import AsyncKanbanFlowBoard, TokenBucket, retry_after
+from conftest import add_card, COLUMNS, CARD_TYPES
+from fake_kanbanflow import FakeKanbanFlowServer
+from kanban_flow_board import with_id_marker
+from omnifocus import OmnifocusTask
+
+
+def run_board(server, id_store, sync, **kwargs):
+    """Load a board from server, run the coroutine sync(board) on it and close it again."""
+    async def run():
+        board = AsyncKanbanFlowBoard("test", "todo", CARD_TYPES, id_store, api_uri=server.api_uri, **kwargs)
+        try:
+            await board.load(["done"])
+            return board, await sync(board)
+        finally:
+            await board.close()
+    return asyncio.run(run())
+
+
+def test_async_sync_creates_cards_and_stores_fingerprints(server, id_store):
+    _, added = run_board(server, id_store, lambda board: board.create_tasks([OmnifocusTask("of-1", "First", "work")]))
+    assert added == 1
+    assert id_store.get("of-1")["fingerprint"] is not None
+
+
+def test_async_update_keeps_the_snapshot_current(server, id_store):
+    card_id = add_card(server.state, "Old name", description=with_id_marker("", "of-1"))
+
+    board, updated = run_board(server, id_store,
+                               lambda board: board.create_tasks([OmnifocusTask("of-1", "New name", "work")]))
+    assert updated == 1
+    assert server.state.tasks[card_id]["name"] == "New name"
+    assert board.all_tasks["of-1"]["name"] == "New name"
+
+
+def test_token_bucket_spends_its_burst_then_waits():
+    async def spend():
+        # a burst of 6, then one token every 0.1s
+        bucket = TokenBucket(60 * 10 + 6, burst=6)
+        start = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(spend())
+    assert burst < 0.05
+    assert 0.05 < total < 0.5
+
+
+def test_paused_token_bucket_waits_out_the_pause():
+    async def pause():
+        bucket = TokenBucket(6000)
+        bucket.pause(0.3)
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert 0.25 < asyncio.run(pause()) < 1
+
+
+def test_retry_after_reads_seconds_or_falls_back_to_backoff():
+    assert retry_after("3", 0) == 3
+    assert retry_after("-1", 0) == 0
+    assert retry_after("Wed, 21 Oct 2015 07:28:00 GMT", 0) == 0
+    assert retry_after(None, 3) == 8
+    assert retry_after("soon", 10) == 60
+
+
+def test_rate_limited_requests_are_retried_after_retry_after(id_store):
+    server = FakeKanbanFlowServer(COLUMNS, rate_window=1).start()
+    try:
+        tasks = [OmnifocusTask("of-{0}".format(index), "Task {0}".format(index), "work") for index in range(4)]
+
+        async def create(board):
+            server.rate_limit = 2
+            return await board.create_tasks(tasks)
+
+        board, added = run_board(server, id_store, create)
+        assert added == 4
+        assert server.throttled > 0
+        assert len(server.state.tasks) == 4
+        assert board.take_failed_cards() == []
+        statuses = [endpoint["statuses"] for endpoint in board.metrics.to_dict()["endpoints"]
+                    if endpoint["method"] == "POST"]
+        assert statuses[0]["429"] == server.throttled
+    finally:
+        server.stop()
+
+
+def test_timed_out_post_is_not_retried(server, id_store):
+    async def create_slowly(board):
+        server.latency = 0.5
+        return await board.create_tasks([OmnifocusTask("of-1", "First", "work")])
+
+    board, added = run_board(server, id_store, create_slowly, request_timeout=(1, 0.2))
+    assert added == 0
+    assert board.take_failed_cards() == ["of-1"]
+    posts = [endpoint for endpoint in board.metrics.to_dict()["endpoints"] if endpoint["method"] == "POST"]
+    assert posts[0]["statuses"] == {"error": 1}
+
+    # the server made the card after the client gave up on it; a retry would have made a second one
+    time.sleep(0.5)
+    assert len(server.state.tasks) == 1
+
+
+def test_timed_out_get_is_retried(server, id_store):
+    async def read_slowly(board):
+        server.latency = 0.5
+        return await board.request(board.board_uri)
+
+    board, details = run_board(server, id_store, read_slowly, max_retries=1, request_timeout=(1, 0.2))
+    assert details is None
+    gets = [endpoint for endpoint in board.metrics.to_dict()["endpoints"]
+            if endpoint["method"] == "GET" and endpoint["endpoint"] == "board"]
+    # the 200 is the board load
+    assert gets[0]["statuses"] == {"200": 1, "error": 2}
@@ -0,0 +1,33 @@
+from change_tracker import ChangeTracker
+from omnifocus import OmnifocusTask
+
+
+class FakeOmnifocus:
+    def __init__(self, of_location, tasks):
+        self.of_location = of_location
+        self.tasks = tasks
+
+    def iter_flagged_tasks(self):
+        return iter(self.tasks)
+
+
+def test_tasks_that_failed_to_sync_are_offered_again(tmp_path):
+    db_path = tmp_path / "OmniFocusDatabase.db"
+    db_path.write_bytes(b"")
+    omnifocus = FakeOmnifocus(str(db_path), [OmnifocusTask("a", "A", modified=1.0),
+                                             OmnifocusTask("b", "B", modified=1.0)])
+    tracker = ChangeTracker(str(tmp_path / "omnifocus-state.db"))
+
+    changed, _ = tracker.changed_tasks(omnifocus)
+    assert [task.identifier for task in changed] == ["a", "b"]
+    tracker.commit(["b"])
+
+    # the database is untouched, but it's read again because b didn't sync
+    changed, removed = tracker.changed_tasks(omnifocus)
+    assert [task.identifier for task in changed] == ["b"]
+    assert removed == []
+    tracker.commit([])
+
+    changed, _ = tracker.changed_tasks(omnifocus)
+    assert changed == []
+    tracker.close()
@@ -0,0 +1,62 @@
+from id_store import IdStore
+
+
+def test_fingerprint_and_details_are_dropped_when_a_card_is_replaced(id_store):
+    id_store.put("of-1", "task-1", None, "todo")
+    id_store.set_fingerprint("of-1", "abc")
+    id_store.put_details("task-1", "todo", {"_id": "task-1"})
+
+    id_store.put("of-1", "task-1", None, "done")
+    assert id_store.get("of-1")["fingerprint"] == "abc"
+
+    id_store.put("of-1", "task-2", None, "todo")
+    entry = id_store.get("of-1")
+    assert entry["fingerprint"] is None
+    assert entry["details"] is None
+    assert id_store.get_by_task_id("task-1") is None
+
+
+def test_mapping_a_card_clears_its_unmapped_entry(id_store):
+    id_store.put_unmapped("task-1")
+    assert id_store.is_unmapped("task-1")
+    id_store.put("of-1", "task-1", "comment-1", "todo")
+    assert not id_store.is_unmapped("task-1")
+
+
+def test_retain_task_ids_forgets_cards_no_longer_on_the_board(id_store):
+    id_store.put("of-1", "task-1", None, "todo")
+    id_store.put("of-2", "task-2", None, "todo")
+    id_store.put_unmapped("task-3")
+
+    assert id_store.retain_task_ids({"task-1"}) == 1
+    assert [row["external_id"] for row in id_store.all()] == ["of-1"]
+    assert not id_store.is_unmapped("task-3")
+
+
+def test_card_details_need_every_card(id_store):
+    id_store.put("of-1", "task-1", None, "todo")
+    id_store.put("of-2", "task-2", None, "done")
+    id_store.put_details("task-1", "todo", {"_id": "task-1"})
+    assert id_store.card_details() is None
+
+    id_store.put_details("task-2", "done", {"_id": "task-2"})
+    assert sorted(id_store.card_details()) == [("of-1", "todo", {"_id": "task-1"}),
+                                               ("of-2", "done", {"_id": "task-2"})]
+
+
+def test_board_details_expire(id_store):
+    id_store.put_board_details("uri", {"columns": []})
+    assert id_store.get_board_details("uri", 60) == {"columns": []}
+    assert id_store.get_board_details("uri", -1) is None
+    assert id_store.get_board_details("other", 60) is None
+
+
+def test_store_survives_reopening(tmp_path):
+    path = str(tmp_path / "kanbanflow-ids.db")
+    store = IdStore(path)
+    store.put("of-1", "task-1", None, "todo")
+    store.close()
+
+    store = IdStore(path)
+    assert store.get("of-1")["task_id"] == "task-1"
+    store.close()
@@ -0,0 +1,53 @@
+import pytest
+
+from kanban_board import board_configs, board_tasks
+from omnifocus import OmnifocusTask
+
+
+def test_config_without_boards_is_one_board():
+    config = {"token": "test", "card_types": {"work": {}}}
+    assert board_configs(config) == [config]
+
+
+def test_boards_take_the_top_level_keys_as_defaults():
+    config = {"token": "shared", "id_store": "ignored.db", "card_types": {"work": {}},
+              "boards": [{"name": "work"}, {"token": "own", "id_store": "home.db"}]}
+    work, second = board_configs(config)
+    assert work["token"] == "shared"
+    assert work["card_types"] == {"work": {}}
+    assert work["id_store"] != "ignored.db"
+    assert second["name"] == "board2"
+    assert second["token"] == "own"
+    assert second["id_store"] == "home.db"
+
+
+def test_board_names_must_be_unique():
+    with pytest.raises(ValueError):
+        board_configs({"boards": [{"name": "work"}, {"name": "work"}]})
+
+
+@pytest.mark.parametrize("config", [{"event_queue": "events.db", "boards": [{"name": "work"}]},
+                                    {"boards": [{"name": "work"}, {"name": "home", "event_queue": "events.db"}]}])
+def test_event_queue_is_refused_with_boards(config):
+    with pytest.raises(ValueError):
+        board_configs(config)
+
+
+def test_each_board_types_tasks_by_its_own_card_types():
+    tasks = [OmnifocusTask("of-1", "Both", "work", tags=("home", "work")),
+             OmnifocusTask("of-2", "Home", "home", tags=("home",)),
+             OmnifocusTask("of-3", "Errand", None, tags=("errands",))]
+
+    home = board_tasks({"name": "home", "card_types": {"home": {}, "errands": {}}, "tags": ["home"]}, tasks)
+    assert [(task.identifier, task.type) for task in home] == [("of-1", "home"), ("of-2", "home")]
+    # the shared task keeps its type for the other boards
+    assert tasks[0].type == "work"
+
+    errands = board_tasks({"name": "errands", "card_types": {"errands": {}, "home": {}}}, tasks)
+    assert [(task.identifier, task.type) for task in errands] == [("of-1", "home"), ("of-2", "home"),
+                                                                  ("of-3", "errands")]
+
+
+def test_board_without_card_types_is_refused():
+    with pytest.raises(ValueError):
+        board_tasks({"name": "broken"}, [])
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from conftest import add_card, COLUMNS, CARD_TYPES
+from fake_kanbanflow import FakeKanbanFlowServer
+from kanban_flow_board import KanbanFlowBoard, with_id_marker, strip_id_marker, description_external_id
+from omnifocus import OmnifocusTask
+
+
+def test_comment_lookup_failure_leaves_card_to_be_looked_up_again(server, id_store, make_board):
+    card_ids = [add_card(server.state, "Legacy {0}".format(index), "done", comment="external_id=of-{0}".format(index))
+                for index in range(5)]
+    # /board and the three columns get through, then one comment lookup before the limit
+    server.rate_limit = 5
+
+    with pytest.raises(IOError):
+        make_board(max_workers=1)
+    assert not any(id_store.is_unmapped(card_id) for card_id in card_ids)
+    assert len(id_store.all()) == 1
+
+    server.rate_limit = 0
+    board = make_board()
+    assert sorted(board.all_tasks) == ["of-{0}".format(index) for index in range(5)]
+
+
+def test_card_without_comment_is_not_looked_up_again(server, id_store, make_board):
+    card_id = add_card(server.state, "Made by hand")
+    make_board()
+    assert id_store.is_unmapped(card_id)
+
+    server.reset_counters()
+    make_board()
+    # /board comes from the cache, so that's just the three columns
+    assert server.requests == 3
+
+
+def test_failed_creates_are_reported(server, make_board):
+    board = make_board()
+    server.rate_limit = 1
+    # the first create uses up the limit, the second is throttled
+    assert board.create_tasks([OmnifocusTask("of-1", "First", "work"), OmnifocusTask("of-2", "Second", "work")]) == 1
+    assert board.take_failed_cards() == ["of-2"]
+    assert board.take_failed_cards() == []
+
+
+def test_board_with_swimlanes_is_read_a_swimlane_at_a_time(id_store):
+    server = FakeKanbanFlowServer(COLUMNS, swimlanes=[("lane-a", "A"), ("lane-b", "B")]).start()
+    try:
+        # more than a page in each swimlane of the done column
+        for index in range(260):
+            identifier = "of-{0}".format(index)
+            add_card(server.state, identifier, "done" if index % 2 else "todo",
+                     description=with_id_marker("", identifier), swimlaneId="lane-a" if index % 3 else "lane-b")
+
+        board = KanbanFlowBoard("test", "todo", CARD_TYPES, ["done"], id_store, api_uri=server.api_uri)
+        assert len(board.all_tasks) == 260
+        assert sorted(card["id"] for card in board.completed_tasks) == \
+            sorted("of-{0}".format(index) for index in range(260) if index % 2)
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("note", ["", "Notes", "Notes\n", "Notes\n\n", "\n", "  Indented\n  "])
+def test_id_marker_round_trips_the_note(note):
+    description = with_id_marker(note, "of-1")
+    assert description_external_id({"description": description}) == "of-1"
+    assert strip_id_marker(description) == note
+    assert with_id_marker(description, "of-1") == description
+
+
+def test_note_with_trailing_newline_is_not_updated_every_run(server, make_board):
+    task = OmnifocusTask("of-1", "Task", "work", note="Notes\n")
+    make_board().create_tasks([task])
+
+    server.reset_counters()
+    make_board().create_tasks([task])
+    # the three columns and nothing for the card
+    assert server.requests == 3
+
+
+def test_stalled_request_times_out(server, make_board):
+    board = make_board(request_timeout=(1, 0.2))
+    server.latency = 1
+
+    start = time.monotonic()
+    assert board.request(board.board_uri) is None
+    assert time.monotonic() - start < 1
+    board_requests = [endpoint["statuses"] for endpoint in board.metrics.to_dict()["endpoints"]
+                      if endpoint["endpoint"] == "board"]
+    # the 200 is the board load
+    assert board_requests == [{"200": 1, "error": 1}]
+
+
+
+def test_board_state_is_per_instance():
+    # a mutable class attribute would be shared by every board, e.g. on the multi-board workers
+    assert not [name for name, value in vars(KanbanFlowBoard).items() if isinstance(value, (dict, list, set))]
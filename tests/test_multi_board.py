@@ -0,0 +1,29 @@
+from conftest import CARD_TYPES
+from generate_omnifocus_db import generate
+from multi_board import MultiBoardSync
+from omnifocus import OmnifocusTask
+
+
+def board_config(server, tmp_path, name, **overrides):
+    config = {"name": name, "token": "test", "default_drop_lane": "todo", "completed_lanes": ["done"],
+              "card_types": CARD_TYPES, "api_uri": server.api_uri,
+              "id_store": str(tmp_path / "kanbanflow-ids-{0}.db".format(name))}
+    config.update(overrides)
+    return config
+
+
+def test_board_without_card_types_fails_alone(server, tmp_path):
+    configs = [board_config(server, tmp_path, "broken", card_types=None),
+               board_config(server, tmp_path, "work", tags=["work"])]
+    tasks = [OmnifocusTask("of-1", "Work task", "work", tags=("work",)),
+             OmnifocusTask("of-2", "Home task", "home", tags=("home",))]
+
+    of_location = str(tmp_path / "OmniFocusDatabase.db")
+    generate(of_location, 10)
+
+    broken, work = MultiBoardSync(configs, of_location).run(tasks)
+
+    assert isinstance(broken.error, ValueError)
+    assert work.error is None
+    assert work.cards_added == 1
+    assert [task["name"] for task in server.state.tasks.values()] == ["Work task"]
@@ -0,0 +1,148 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from generate_omnifocus_db import SCHEMA, generate
+from omnifocus import Omnifocus, card_type_index, card_type
+from applescript_executor import RecordingExecutor
+
+# FLAGGED_TASKS_SQL before the deferral, blocked and next-task rules moved into it, and the Python filter it was
+# followed by; the query has to keep exactly the rows the filter kept
+LEGACY_FLAGGED_TASKS_SQL = """
+SELECT Task.persistentIdentifier,
+       Task.name,
+       Task.blocked,
+       Task.dateToStart,
+       Task.childrenCount,
+       Task.containsNextTask
+FROM Task
+JOIN TaskToTag ON TaskToTag.task = Task.persistentIdentifier
+JOIN Context ON Context.persistentIdentifier = TaskToTag.tag
+JOIN ProjectInfo ON ProjectInfo.task = Task.containingProjectInfo
+WHERE Task.flagged = 1
+  AND Task.effectiveFlagged = 1
+  AND Task.dateCompleted IS NULL
+  AND Task.blockedByFutureStartDate IS 0
+  AND ProjectInfo.status NOT IN ('done',
+                                 'dropped',
+                                 'inactive')
+"""
+
+LEGACY_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+PAST = "2001-02-03T04:05:06.789Z"
+FUTURE = "2099-01-01T00:00:00.000Z"
+
+# name, blocked, dateToStart, children, containsNextTask; children are (blocked,) tuples so childrenCount is real
+FLAGGED_CASES = [
+    ("Plain", 0, None, 0, 0),
+    ("Null flags", None, None, None, None),
+    ("Deferred", 0, FUTURE, 0, 0),
+    ("Started", 0, PAST, 0, 0),
+    ("Started without zone", 0, PAST[:-1], 0, 0),
+    ("Blocked", 1, None, 0, 0),
+    ("WF blocked", 1, None, 0, 0),
+    ("WF deferred", 1, FUTURE, 0, 0),
+    ("Parent without next task", 0, None, 2, 0),
+    ("WF parent without next task", 0, None, 2, 0),
+    ("Parent with next task", 0, None, 2, 1),
+    ("Blocked parent with next task", 1, None, 2, 1),
+    ("Blocked parent without next task", 1, None, 1, 0),
+    ("WF blocked parent without next task", 1, None, 1, 0),
+    ("Deferred parent with next task", 0, FUTURE, 1, 1),
+    ("Started parent with next task", 1, PAST, 3, 1),
+    ("Parent with null next task", 0, None, 1, None),
+]
+
+
+def legacy_keeps(row):
+    name = row['name']
+    child_count = row['childrenCount']
+    held = name.startswith('WF')
+    start_date = row['dateToStart']
+    if start_date is not None:
+        if start_date[-1:] != "Z":
+            start_date += "Z"
+        if datetime.strptime(start_date, LEGACY_DATETIME_FORMAT) > datetime.now():
+            return False
+    if (child_count and not row['containsNextTask']) and (child_count and not held):
+        return False
+    if row['blocked'] and not child_count and not held:
+        return False
+    return True
+
+
+@pytest.fixture
+def omnifocus_db(tmp_path):
+    path = str(tmp_path / "OmniFocusDatabase.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT INTO Context VALUES ('tag-work', 'work')")
+    conn.execute("INSERT INTO ProjectInfo VALUES ('project', 'active')")
+    for index, (name, blocked, date_to_start, children, next_task) in enumerate(FLAGGED_CASES):
+        _id = "task-{0}".format(index)
+        insert_task(conn, _id, name, None, 1, blocked, date_to_start, children, next_task)
+        for child in range(children or 0):
+            insert_task(conn, "{0}.{1}".format(_id, child), "Step {0}".format(child), _id, 0, 0, None, 0, 0)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def insert_task(conn, _id, name, parent, flagged, blocked, date_to_start, children, next_task):
+    conn.execute("INSERT INTO Task (persistentIdentifier, name, containingProjectInfo, parent, blocked, "
+                 "blockedByFutureStartDate, flagged, effectiveFlagged, dateToStart, childrenCount, containsNextTask) "
+                 "VALUES (?, ?, 'project', ?, ?, 0, ?, ?, ?, ?, ?)",
+                 (_id, name, parent, blocked, flagged, flagged, date_to_start, children, next_task))
+    conn.execute("INSERT INTO TaskToTag VALUES (?, 'tag-work')", (_id,))
+
+
+def test_flagged_tasks_sql_matches_legacy_filter(omnifocus_db):
+    conn = sqlite3.connect(omnifocus_db)
+    conn.row_factory = sqlite3.Row
+    expected = set(row['persistentIdentifier'] for row in conn.execute(LEGACY_FLAGGED_TASKS_SQL)
+                   if legacy_keeps(row))
+    conn.close()
+
+    omnifocus = Omnifocus(RecordingExecutor(), omnifocus_db)
+    tasks = omnifocus.flagged_tasks()
+    omnifocus.close()
+
+    assert set(tasks) == expected
+    # every rule has a case that is dropped and one that is kept
+    names = set(task.name for task in tasks.values())
+    assert {"Started", "WF blocked", "WF parent without next task", "Parent with next task"} <= names
+    assert not names & {"Deferred", "WF deferred", "Blocked", "Parent without next task"}
+
+
+def test_card_type_is_the_highest_priority_tag():
+    index = card_type_index(["work", "home", "errands"])
+    assert card_type(("errands", "home"), index) == "home"
+    assert card_type(("calls",), index) is None
+    assert card_type(("calls", "work"), card_type_index(["work", "home"], tags=["home"])) is None
+    assert card_type(("calls", "work")) == "calls"
+
+
+def test_tasks_with_several_tags_are_read_once(tmp_path):
+    of_location = str(tmp_path / "OmniFocusDatabase.db")
+    generate(of_location, 300, max_tags=3)
+    card_types = {"work": {}, "home": {}}
+
+    conn = sqlite3.connect(of_location)
+    tag_counts = dict(conn.execute("SELECT task, count(*) FROM TaskToTag GROUP BY task"))
+    conn.close()
+
+    omnifocus = Omnifocus(RecordingExecutor(), of_location, card_types=card_types)
+    tasks = list(omnifocus.iter_flagged_tasks(batch_size=7))
+    omnifocus.close()
+
+    assert len(tasks) == len(set(task.identifier for task in tasks))
+    assert any(tag_counts[task.identifier] > 1 for task in tasks)
+    for task in tasks:
+        assert len(task.tags) == tag_counts[task.identifier]
+        assert task.type == ("work" if "work" in task.tags else "home")
+        for child in task.children or []:
+            assert child.name.startswith("Step " + task.identifier)
+        if task.children:
+            assert len(task.children) == len(set(child.identifier for child in task.children))
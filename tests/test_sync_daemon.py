@@ -0,0 +1,94 @@
+import sqlite3
+
+from omnifocus import TaskDetails
+from sync_daemon import SyncDaemon
+from sync_metrics import SyncMetrics
+
+
+class LockedOmnifocus:
+    """Fails to refresh the first time, like a read while OmniFocus checkpoints its WAL."""
+
+    def __init__(self, of_location):
+        self.of_location = of_location
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+        if self.refreshes == 1:
+            raise sqlite3.OperationalError("database is locked")
+
+    def task_details(self, identifiers):
+        return dict()
+
+
+class FailingCloseOmnifocus(LockedOmnifocus):
+    """Has a completed card's task to close, and fails the first close like an AppleScript error."""
+
+    def __init__(self, of_location):
+        super().__init__(of_location)
+        self.closes = 0
+
+    def refresh(self):
+        pass
+
+    def task_details(self, identifiers):
+        return dict((_id, TaskDetails("Card", None, None)) for _id in identifiers)
+
+    def close_tasks(self, identifiers, details=None):
+        self.closes += 1
+        if self.closes == 1:
+            raise RuntimeError("OmniFocus got an error: AppleEvent timed out")
+        return identifiers, []
+
+
+class EmptyTracker:
+    def __init__(self):
+        self.commits = 0
+
+    def changed_tasks(self, omnifocus, full=False):
+        return [], []
+
+    def commit(self, failed=None):
+        self.commits += 1
+
+
+class IdleBoard:
+    metrics = SyncMetrics()
+    completed_tasks = []
+
+
+class CompletedCardBoard(IdleBoard):
+    completed_tasks = [{"id": "of-1", "name": "Card"}]
+
+    def commit_fingerprints(self):
+        pass
+
+    def take_failed_cards(self):
+        return []
+
+
+def test_sqlite_error_fails_one_sync_not_the_daemon(tmp_path):
+    db_path = tmp_path / "OmniFocusDatabase.db"
+    db_path.write_bytes(b"")
+    tracker = EmptyTracker()
+    daemon = SyncDaemon(IdleBoard(), LockedOmnifocus(str(db_path)), tracker)
+
+    assert daemon.sync() is None
+    assert tracker.commits == 0
+
+    daemon.sync()
+    assert tracker.commits == 1
+
+
+def test_any_error_fails_one_sync_not_the_daemon(tmp_path):
+    db_path = tmp_path / "OmniFocusDatabase.db"
+    db_path.write_bytes(b"")
+    tracker = EmptyTracker()
+    omnifocus = FailingCloseOmnifocus(str(db_path))
+    daemon = SyncDaemon(CompletedCardBoard(), omnifocus, tracker)
+
+    assert daemon.sync() is None
+    assert tracker.commits == 0
+
+    assert daemon.sync().startswith("0 update(s), 1 task(s) closed")
+    assert tracker.commits == 1
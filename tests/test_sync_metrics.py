@@ -0,0 +1,47 @@
+import json
+
+from sync_metrics import SyncMetrics, render_prometheus, render_json, endpoint_name
+
+
+def test_endpoint_names_collapse_ids():
+    assert endpoint_name("tasks/abc123/comments/def456") == "tasks/{id}/comments/{id}"
+    assert endpoint_name("tasks?columnId=todo&limit=100") == "tasks"
+
+
+def test_requests_are_counted_per_endpoint_and_status():
+    metrics = SyncMetrics()
+    metrics.record_request("GET", "tasks/a/comments", 200, 0.01, 100)
+    metrics.record_request("GET", "tasks/b/comments", 429, 0.2, 10)
+    with metrics.phase("plan"):
+        pass
+
+    data = metrics.to_dict()
+    assert metrics.api_requests == 2
+    assert metrics.bytes_transferred == 110
+    assert data["endpoints"][0]["statuses"] == {"200": 1, "429": 1}
+    assert data["phases"]["plan"]["runs"] == 1
+
+
+def test_prometheus_output_labels_each_board():
+    work = SyncMetrics(labels={"board": "work"})
+    home = SyncMetrics(labels={"board": "home"})
+    work.record_request("POST", "tasks", 200, 0.01, 5)
+
+    text = render_prometheus([work, home])
+    assert 'of_to_kb_api_requests_total{board="work",endpoint="tasks",method="POST",status="200"} 1' in text
+    assert 'of_to_kb_run_started_timestamp_seconds{board="home"}' in text
+    assert 'of_to_kb_api_request_duration_seconds_bucket{board="work",endpoint="tasks",method="POST",le="+Inf"} 1' \
+        in text
+
+
+def test_json_output_is_a_list_for_several_boards():
+    assert isinstance(json.loads(render_json([SyncMetrics()])), dict)
+    assert len(json.loads(render_json([SyncMetrics(), SyncMetrics()]))) == 2
+
+
+def test_prometheus_file_is_replaced_whole(tmp_path):
+    path = tmp_path / "of_to_kb.prom"
+    path.write_text("old")
+    SyncMetrics().write_prometheus(str(path))
+    assert path.read_text().startswith("# HELP")
+    assert [entry.name for entry in tmp_path.iterdir()] == ["of_to_kb.prom"]
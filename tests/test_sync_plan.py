@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+from applescript_executor import RecordingExecutor
+from conftest import CARD_TYPES
+from generate_omnifocus_db import generate
+from omnifocus import Omnifocus
+from sync_plan import plan_sync, SyncExecutor
+
+
+@pytest.fixture
+def omnifocus(tmp_path):
+    of_location = str(tmp_path / "OmniFocusDatabase.db")
+    generate(of_location, 60)
+    omnifocus = Omnifocus(RecordingExecutor(), of_location, card_types=CARD_TYPES)
+    yield omnifocus
+    omnifocus.close()
+
+
+def sync(board, omnifocus):
+    tasks = list(omnifocus.flagged_tasks().values())
+    plan = plan_sync(board, omnifocus, board.completed_tasks, tasks)
+    return plan, SyncExecutor(board, omnifocus, batch_size=7).execute(plan)
+
+
+def test_first_sync_creates_a_card_per_task(server, make_board, omnifocus):
+    tasks = omnifocus.flagged_tasks()
+    assert tasks
+
+    plan, _ = sync(make_board(), omnifocus)
+    assert len(plan.creates) == len(tasks)
+    assert plan.api_calls() == len(tasks)
+    assert sorted(task["name"] for task in server.state.tasks.values()) == sorted(task.name for task in tasks.values())
+
+    # the fingerprints stored by the first sync leave nothing to do
+    server.reset_counters()
+    plan, _ = sync(make_board(), omnifocus)
+    assert not plan.items()
+    assert len(plan.skipped) == len(tasks)
+
+
+def test_cards_in_a_completed_lane_close_their_tasks(server, make_board, omnifocus):
+    sync(make_board(), omnifocus)
+    server.state.move_all("done")
+
+    board = make_board()
+    tasks = omnifocus.flagged_tasks()
+    plan, (updates_made, tasks_closed, repeating_tasks_closed) = sync(board, omnifocus)
+    assert updates_made == 0
+    assert sorted(close.identifier for close in plan.closes) == sorted(tasks)
+    assert sorted(task["id"] for task in tasks_closed) == sorted(tasks)
+    assert sorted(_id for call in omnifocus.executor.calls for _id in call) == sorted(tasks)
+
+
+def test_completed_tasks_are_not_closed_again(server, make_board, omnifocus):
+    sync(make_board(), omnifocus)
+    server.state.move_all("done")
+    completed = sorted(omnifocus.flagged_tasks())[:3]
+    # the live read-only connection sees the write straight away
+    conn = sqlite3.connect(omnifocus.of_location)
+    conn.executemany("UPDATE Task SET dateCompleted = 1 WHERE persistentIdentifier = ?", [(_id,) for _id in completed])
+    conn.commit()
+    conn.close()
+
+    plan, _ = sync(make_board(), omnifocus)
+    assert sorted(plan.skipped) == completed
+    assert not set(close.identifier for close in plan.closes) & set(completed)
+
+
+def test_closing_reads_the_task_details_once(server, make_board, omnifocus, monkeypatch):
+    sync(make_board(), omnifocus)
+    server.state.move_all("done")
+
+    lookups = []
+    task_details = omnifocus.task_details
+    monkeypatch.setattr(omnifocus, "task_details", lambda identifiers: lookups.append(identifiers) or
+                        task_details(identifiers))
+    _, (_, tasks_closed, _) = sync(make_board(), omnifocus)
+    assert tasks_closed
+    assert len(lookups) == 1
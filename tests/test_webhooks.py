@@ -0,0 +1,79 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from conftest import add_card
+from event_queue import EventQueue
+from kanban_flow_board import with_id_marker
+from replay_events import replay
+from webhook_receiver import WebhookReceiver
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = EventQueue(str(tmp_path / "kanbanflow-events.db"), check_same_thread=False)
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def receiver(queue):
+    receiver = WebhookReceiver(queue, port=0, secret="s3cret").start()
+    yield receiver
+    receiver.stop()
+
+
+def post(url, data):
+    with urlopen(Request(url, data, {"Content-Type": "application/json"})) as response:
+        return response.status
+
+
+def test_acked_events_are_dropped(queue):
+    queue.put([{"eventType": "taskCreated"}, {"eventType": "taskChanged"}])
+    (first_id, first), (last_id, _) = queue.pending()
+    assert first == {"eventType": "taskCreated"}
+    assert queue.last_id() == last_id
+
+    queue.ack(first_id)
+    assert [event for _, event in queue.pending()] == [{"eventType": "taskChanged"}]
+    queue.ack(queue.last_id())
+    assert queue.pending() == []
+
+
+def test_replayed_events_are_queued_in_order(receiver, queue):
+    events = [{"eventType": "taskChanged", "task": {"_id": "task-{0}".format(index)}} for index in range(5)]
+    assert replay(receiver.url + "?secret=s3cret", events) == 5
+    assert [event for _, event in queue.pending()] == events
+    assert receiver.events_received == 5
+
+
+def test_requests_without_the_secret_are_refused(receiver, queue):
+    with pytest.raises(HTTPError) as error:
+        post(receiver.url + "?secret=wrong", json.dumps({"eventType": "taskCreated"}).encode("utf-8"))
+    assert error.value.code == 403
+    assert queue.pending() == []
+
+
+def test_invalid_json_is_refused(receiver, queue):
+    with pytest.raises(HTTPError) as error:
+        post(receiver.url + "?secret=s3cret", b"{not json")
+    assert error.value.code == 400
+    assert queue.pending() == []
+
+
+def test_board_with_queued_events_is_loaded_from_the_id_store(server, make_board, queue):
+    card_id = add_card(server.state, "Card", description=with_id_marker("", "of-1"))
+    make_board(event_queue=queue)
+
+    server.state.tasks[card_id]["columnId"] = "done"
+    server.state.record_event("taskChanged", server.state.tasks[card_id], {"columnId": ("todo", "done")})
+    queue.put(server.state.take_events())
+
+    server.reset_counters()
+    board = make_board(event_queue=queue)
+    # just the cached board layout and the queued event, no /tasks pages
+    assert server.requests == 0
+    assert [card["id"] for card in board.completed_tasks] == ["of-1"]
+    assert queue.pending() == []